@@ -0,0 +1,376 @@
+"""
+便签工具性能基准测试
+
+生成 100 / 1k / 10k / 100k 条模拟便签（中文地址、电话、税号、账号等，覆盖六种分类），
+测量存储读写、搜索索引、便签占用内存和卡片渲染等热点路径，结果以 JSON 输出，便于不同版本之间对比。
+
+用法:
+    python benchmark.py                          # 全部规模，结果输出到终端
+    python benchmark.py --sizes 100,1000 -o bench.json
+    python benchmark.py --no-ui                  # 只测存储和索引，不需要图形界面
+
+Linux 下没有 DISPLAY 时会自动通过 xvfb-run 在虚拟显示器中运行界面测试。
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+import sticky_notes_core as core
+
+DEFAULT_SIZES = (100, 1000, 10000, 100000)
+CATEGORIES = ("常用", "地址", "电话", "邮箱", "账号", "其他")
+
+PROVINCES = ("北京市", "上海市", "广东省广州市", "浙江省杭州市", "江苏省南京市", "四川省成都市", "湖北省武汉市")
+DISTRICTS = ("海淀区", "朝阳区", "浦东新区", "天河区", "西湖区", "鼓楼区", "武侯区", "江汉区")
+ROADS = ("中关村大街", "建国路", "世纪大道", "天河路", "文三路", "中山北路", "人民南路", "解放大道")
+COMPANIES = ("华信科技有限公司", "宏达贸易有限责任公司", "东方建设集团", "新星文化传媒有限公司", "瑞丰财务咨询中心")
+BANKS = ("中国工商银行", "中国建设银行", "中国银行", "招商银行", "交通银行")
+PHRASES = (
+    "您好，已收到您的申请，我们会在三个工作日内处理完毕。",
+    "请携带身份证原件及复印件到窗口办理。",
+    "会议改到下周二下午三点，地点不变。",
+    "发票抬头请填写公司全称，税号见下方。",
+    "如有疑问请拨打客服热线咨询。",
+)
+
+
+def generate_note(rng, index, created):
+    """生成一条模拟便签"""
+    category = CATEGORIES[index % len(CATEGORIES)]
+    if category == "地址":
+        title = f"{rng.choice(COMPANIES)}地址"
+        content = (f"{rng.choice(PROVINCES)}{rng.choice(DISTRICTS)}{rng.choice(ROADS)}"
+                   f"{rng.randint(1, 999)}号{rng.randint(1, 30)}层{rng.randint(101, 2999)}室")
+    elif category == "电话":
+        title = f"联系人{index}"
+        content = f"1{rng.choice('3456789')}{rng.randrange(10 ** 9):09d}"
+    elif category == "邮箱":
+        title = f"邮箱{index}"
+        content = f"user{rng.randrange(10 ** 6)}@example{rng.randint(1, 50)}.com"
+    elif category == "账号":
+        title = f"{rng.choice(BANKS)}对公账户"
+        content = (f"开户行：{rng.choice(BANKS)}{rng.choice(DISTRICTS)}支行\n"
+                   f"账号：{rng.randrange(10 ** 18):019d}")
+    elif category == "常用":
+        title = f"{rng.choice(COMPANIES)}税号"
+        content = f"纳税人识别号：91{rng.randrange(10 ** 14):014d}{rng.choice('ABCDEFGHJKLMNPQRTUWXY')}{rng.randint(0, 9)}"
+    else:
+        title = f"备忘 {index}"
+        content = "".join(rng.choice(PHRASES) for _ in range(rng.randint(1, 3)))
+    return {
+        "id": f"{index:08x}{rng.randrange(16 ** 24):024x}",
+        "title": title,
+        "content": content,
+        "category": category,
+        "created_at": created.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+
+
+def generate_notes(size, seed=1983):
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1)
+    return [generate_note(rng, i, start + timedelta(minutes=i)) for i in range(size)]
+
+
+def measure(func, repeat=5, setup=None):
+    """运行 func 若干次，返回耗时统计（毫秒）"""
+    samples = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return {
+        "median_ms": round(statistics.median(samples), 3),
+        "min_ms": round(min(samples), 3),
+        "max_ms": round(max(samples), 3),
+        "repeat": repeat,
+    }
+
+
+def repeat_for(size):
+    return 3 if size >= 100000 else 5
+
+
+def bench_stores(size, notes, workdir):
+    """各存储方式的读取、整体保存、单条插入/修改/删除"""
+    results = []
+    for backend, store_class in core.STORAGE_BACKENDS.items():
+        directory = os.path.join(workdir, f"{backend}_{size}")
+        os.makedirs(directory)
+        path = os.path.join(directory, "sticky_notes_data.json")
+        data = [core.Note.from_dict(note) for note in notes]
+        store = store_class(path, lambda: data)
+        store.compact()
+        store.flush()
+
+        def record(op, stats):
+            results.append(dict(size=size, group="store", backend=backend, op=op, **stats))
+
+        record("save_full", measure(lambda: (store.compact(), store.flush()), repeat_for(size)))
+
+        def load():
+            loader = store_class(path, lambda: [])
+            loader.load()
+            loader.close()
+        record("load", measure(load, repeat_for(size)))
+
+        counter = iter(range(10 ** 9))
+
+        def insert_one():
+            note = core.Note.from_dict(
+                generate_note(random.Random(next(counter)), size + next(counter), datetime.now()))
+            data.insert(0, note)
+            store.put(note, index=0)
+            store.flush()
+        record("insert_one", measure(insert_one, 20))
+
+        def update_one():
+            note = data[len(data) // 2]
+            note.content += "更"
+            store.put(note)
+            store.flush()
+        record("update_one", measure(update_one, 20))
+
+        def delete_one():
+            note = data.pop(0)
+            store.delete(note.id)
+            store.flush()
+        record("delete_one", measure(delete_one, 20))
+
+        if store.direct_query:
+            # 命令行直接在存储中查询（SQLite 全文索引）
+            for query in ("海淀", "纳税人识别号", "9112"):
+                record(f"search:{query}", measure(lambda: store.search(query, limit=100), 10))
+
+        store.close()
+    return results
+
+
+def bench_search(size, notes):
+    """搜索索引的建立、增量更新和查询"""
+    results = []
+
+    def record(op, stats):
+        results.append(dict(size=size, group="search", op=op, **stats))
+
+    records = [core.Note.from_dict(note) for note in notes]
+    index = core.SearchIndex()
+
+    def build():
+        index.__init__()
+        for note in records:
+            index.add(note)
+    record("build_index", measure(build, 1 if size >= 10000 else 3))
+
+    for query in ("海淀", "纳税人识别号", "9112", "招商银行 账号", "example7"):
+        record(f"query:{query}", measure(lambda: index.search(query), 10))
+
+    note = core.Note.from_dict(notes[len(notes) // 2])
+
+    index.add(note)
+
+    def update():
+        old = {"content": note.content}
+        note.content += "新"
+        index.update(note, old)
+    record("update_one", measure(update, 20))
+    return results
+
+
+def traced_size(build):
+    """build() 返回的对象在其存活期间占用的内存（字节）"""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = build()
+        size = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    del result
+    return size
+
+
+def bench_memory(size, notes):
+    """同一份数据文件读入后，以原来的字典和 Note 记录两种形式常驻内存的大小"""
+    text = json.dumps(notes, ensure_ascii=False)
+    as_dicts = traced_size(lambda: json.loads(text))
+    as_records = traced_size(lambda: [core.Note.from_dict(note) for note in json.loads(text)])
+    records = [core.Note.from_dict(note) for note in notes]
+
+    def build_index():
+        index = core.SearchIndex()
+        for note in records:
+            index.add(note)
+        return index
+    index_size = traced_size(build_index)
+    return [
+        dict(size=size, group="memory", op="notes_as_dicts", bytes=as_dicts,
+             bytes_per_note=round(as_dicts / size, 1)),
+        dict(size=size, group="memory", op="notes_as_records", bytes=as_records,
+             bytes_per_note=round(as_records / size, 1),
+             reduction_percent=round(100 * (1 - as_records / as_dicts), 1)),
+        dict(size=size, group="memory", op="search_index", bytes=index_size,
+             bytes_per_note=round(index_size / size, 1)),
+    ]
+
+
+def ensure_display():
+    """Linux 下没有显示器时尝试通过 xvfb-run 重新启动自身"""
+    if not sys.platform.startswith("linux") or os.environ.get("DISPLAY"):
+        return True
+    if shutil.which("xvfb-run") and not os.environ.get("STICKY_BENCH_XVFB"):
+        os.environ["STICKY_BENCH_XVFB"] = "1"
+        os.execvp("xvfb-run", ["xvfb-run", "-a", sys.executable] + sys.argv)
+    return False
+
+
+def pump(root, condition, timeout=600):
+    """处理界面事件直到 condition 成立"""
+    deadline = time.perf_counter() + timeout
+    while not condition():
+        if time.perf_counter() > deadline:
+            raise TimeoutError("等待界面超时")
+        root.update()
+
+
+def bench_ui(size, notes, workdir):
+    """启动、整体刷新、单条插入/删除、跨缩放阈值调整窗口、滚动"""
+    import tkinter as tk
+    from sticky_notes_card import StickyNotesCardApp
+
+    directory = os.path.join(workdir, f"ui_{size}")
+    os.makedirs(directory)
+    with open(os.path.join(directory, "sticky_notes_data.json"), "w", encoding="utf-8") as f:
+        json.dump(notes, f, ensure_ascii=False)
+
+    results = []
+
+    def record(op, stats):
+        results.append(dict(size=size, group="ui", op=op, **stats))
+
+    cwd = os.getcwd()
+    os.chdir(directory)
+    root = tk.Tk()
+    try:
+        start = time.perf_counter()
+        app = StickyNotesCardApp(root)
+        first_paint = time.perf_counter() - start
+        pump(root, lambda: not app.loading)
+        cards_shown = time.perf_counter() - start
+        pump(root, lambda: not app.index_queue)
+        fully_loaded = time.perf_counter() - start
+        record("startup_first_paint", {"median_ms": round(first_paint * 1000, 3), "repeat": 1})
+        record("startup_cards_shown", {"median_ms": round(cards_shown * 1000, 3), "repeat": 1})
+        record("startup_fully_loaded", {"median_ms": round(fully_loaded * 1000, 3), "repeat": 1})
+
+        def settle():
+            root.update_idletasks()
+
+        record("refresh_cards", measure(lambda: (app.refresh_cards(), settle()), repeat_for(size)))
+        record("create_card", measure(lambda: app.create_card().bind_note(app.notes[0]), 10))
+
+        def insert_one():
+            app.new_note()
+            settle()
+
+        def collapse_all():
+            app.collapse_other_cards(None)
+            settle()
+        record("insert_one", measure(insert_one, 10, setup=collapse_all))
+
+        def delete_one():
+            app.delete_note(app.notes[0].id)
+            settle()
+        record("delete_one", measure(delete_one, 10, setup=collapse_all))
+
+        widths = iter([480, 800] * 20)
+
+        def resize():
+            app.pending_width = next(widths)
+            app.last_width = 0
+            app.apply_resize()
+            settle()
+        record("resize_across_scale", measure(resize, 10))
+
+        rng = random.Random(7)
+
+        def scroll():
+            app.canvas.yview_moveto(rng.random())
+            settle()
+        record("scroll_jump", measure(scroll, 30))
+
+        def scroll_step():
+            app.canvas.yview_scroll(3, "units")
+            settle()
+        app.canvas.yview_moveto(0)
+        record("scroll_step", measure(scroll_step, 30))
+
+        record("widget_count", {"count": count_widgets(root)})
+    finally:
+        app.shutdown()  # 命令服务、各笔记本的存储和定时回调都要在销毁窗口前停止
+        root.destroy()
+        os.chdir(cwd)
+    return results
+
+
+def count_widgets(widget):
+    return 1 + sum(count_widgets(child) for child in widget.winfo_children())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="便签工具性能基准测试")
+    parser.add_argument("--sizes", default=",".join(str(s) for s in DEFAULT_SIZES),
+                        help="便签数量，逗号分隔（默认 100,1000,10000,100000）")
+    parser.add_argument("-o", "--output", help="结果 JSON 文件（默认输出到终端）")
+    parser.add_argument("--no-ui", action="store_true", help="跳过界面测试")
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    ui_available = not args.no_ui and ensure_display()
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "sizes": sizes,
+            "ui": ui_available,
+        },
+        "results": [],
+    }
+
+    workdir = tempfile.mkdtemp(prefix="sticky_bench_")
+    try:
+        for size in sizes:
+            print(f"[bench] {size} 条便签...", file=sys.stderr, flush=True)
+            notes = generate_notes(size)
+            report["results"].extend(bench_stores(size, notes, workdir))
+            report["results"].extend(bench_search(size, notes))
+            report["results"].extend(bench_memory(size, notes))
+            if ui_available:
+                report["results"].extend(bench_ui(size, notes, workdir))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,74 +3,219 @@
 修复删除按钮功能
 """
 import tkinter as tk
-from tkinter import ttk, messagebox
+from tkinter import ttk, messagebox, simpledialog, filedialog
+from tkinter import font as tkfont
+import functools
 import json
 import os
+import queue
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
 from datetime import datetime
 
+from sticky_notes_core import (
+    CONFIG_FILE, DATA_FILE, MANIFEST_FILE, STORAGE_BACKENDS,
+    CommandServer, JournalStore, Note, Notebook, NotebookManifest, TemplateError,
+    iter_import_file, load_config, send_command, write_export_file,
+)
+
+STARTED_AT = time.perf_counter()
+
+
+def notebook_attribute(name):
+    """把界面对象上的同名属性转到当前笔记本"""
+    return property(lambda self: getattr(self.notebook, name),
+                    lambda self, value: setattr(self.notebook, name, value))
+
+
+class Profiler:
+    """界面事件耗时统计（--profile 开启）
+    
+    记录各回调的耗时直方图和事件循环卡顿时长，可在调试面板查看或导出为 JSON 文件，
+    用于把“卡顿”反馈和便签数量对应起来。
+    """
+    bucket_bounds = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000)  # 毫秒，最后一档为更大值
+    heartbeat_interval = 50
+    stall_threshold = 30
+    
+    def __init__(self):
+        self.stats = {}
+        self.started_at = time.time()
+        self.expected_beat = None
+        
+    def record(self, name, elapsed_ms):
+        stat = self.stats.get(name)
+        if stat is None:
+            stat = self.stats[name] = {
+                "count": 0,
+                "total_ms": 0.0,
+                "max_ms": 0.0,
+                "histogram": [0] * (len(self.bucket_bounds) + 1),
+            }
+        stat["count"] += 1
+        stat["total_ms"] += elapsed_ms
+        stat["max_ms"] = max(stat["max_ms"], elapsed_ms)
+        bucket = len(self.bucket_bounds)
+        for i, bound in enumerate(self.bucket_bounds):
+            if elapsed_ms <= bound:
+                bucket = i
+                break
+        stat["histogram"][bucket] += 1
+        
+    def wrap(self, name, func):
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.record(name, (time.perf_counter() - start) * 1000)
+        return timed
+        
+    def instrument(self, obj, names):
+        """把 obj 上的方法替换为计时版本（obj 为类时对所有实例生效）"""
+        for name in names:
+            setattr(obj, name, self.wrap(name, getattr(obj, name)))
+            
+    def start_heartbeat(self, root):
+        """定时心跳：实际触发时间比预期晚得越多，说明事件循环被阻塞得越久"""
+        now = time.perf_counter()
+        if self.expected_beat is not None:
+            late_ms = (now - self.expected_beat) * 1000
+            if late_ms > self.stall_threshold:
+                self.record("event_loop_stall", late_ms)
+        self.expected_beat = now + self.heartbeat_interval / 1000
+        root.after(self.heartbeat_interval, self.start_heartbeat, root)
+        
+    def percentile(self, stat, fraction):
+        """按直方图估算分位数（返回所在档的上限）"""
+        target = stat["count"] * fraction
+        seen = 0
+        for i, count in enumerate(stat["histogram"]):
+            seen += count
+            if seen >= target and count:
+                return self.bucket_bounds[i] if i < len(self.bucket_bounds) else stat["max_ms"]
+        return stat["max_ms"]
+        
+    def snapshot(self, extra=None):
+        data = {
+            "started_at": datetime.fromtimestamp(self.started_at).strftime("%Y-%m-%d %H:%M:%S"),
+            "uptime_s": round(time.time() - self.started_at, 1),
+            "bucket_bounds_ms": list(self.bucket_bounds),
+            "callbacks": {
+                name: dict(stat,
+                           total_ms=round(stat["total_ms"], 3),
+                           max_ms=round(stat["max_ms"], 3),
+                           avg_ms=round(stat["total_ms"] / stat["count"], 3),
+                           p50_ms=self.percentile(stat, 0.5),
+                           p95_ms=self.percentile(stat, 0.95))
+                for name, stat in self.stats.items()
+            },
+        }
+        if extra:
+            data.update(extra)
+        return data
+        
+    def report(self, extra=None):
+        """格式化为调试面板显示的文本"""
+        lines = [f"{'回调':<20}{'次数':>4}{'平均':>7}{'P95':>8}{'最大':>7}"]  # 中文占两列
+        for name, stat in sorted(self.stats.items()):
+            lines.append(
+                f"{name:<22}{stat['count']:>6}{stat['total_ms'] / stat['count']:>9.1f}"
+                f"{self.percentile(stat, 0.95):>8.0f}{stat['max_ms']:>9.1f}"
+            )
+        if extra:
+            lines.append("")
+            lines.extend(f"{key}: {value}" for key, value in extra.items())
+        return "\n".join(lines)
+
 
 class NoteCard(tk.Frame):
-    """便签卡片组件 - 极简版"""
-    def __init__(self, parent, note_data, index, app):
+    """便签卡片组件 - 可复用，通过 bind_note 绑定到不同的便签数据"""
+    category_colors = {
+        "常用": "#4CAF50",
+        "地址": "#2196F3", 
+        "电话": "#FF9800",
+        "邮箱": "#9C27B0",
+        "账号": "#F44336",
+        "其他": "#607D8B"
+    }
+    
+    def __init__(self, parent, app):
         super().__init__(parent, bg="#ffffff", relief=tk.FLAT, bd=0)
-        self.note_data = note_data
-        self.index = index
+        self.note_data = None
         self.app = app
         self.is_expanded = False
-        
-        self.category_colors = {
-            "常用": "#4CAF50",
-            "地址": "#2196F3", 
-            "电话": "#FF9800",
-            "邮箱": "#9C27B0",
-            "账号": "#F44336",
-            "其他": "#607D8B"
-        }
+        self.canvas_item = None
+        self.edit_frame = None
+        self.edit_start = None       # 展开时的字段值，收起时合并为一条撤销记录
+        self.shown_preview = None    # 当前预览标签显示的缓存数据
         
         self.configure(highlightbackground="#ddd", highlightthickness=1)
         self.create_preview()
         
-    def get_scaled_font_size(self, base_size):
-        """计算缩放字体，但保持最小值"""
-        scaled = int(base_size * self.app.font_scale)
-        min_sizes = {7: 7, 8: 8, 9: 9, 10: 10, 11: 11}
-        return max(scaled, min_sizes.get(base_size, base_size))
+    @property
+    def note_id(self):
+        return self.note_data.id if self.note_data else None
         
-    def create_preview(self):
-        """创建预览模式"""
-        for widget in self.winfo_children():
-            widget.destroy()
+    def bind_note(self, note_data):
+        """绑定到另一条便签，只更新已有组件的内容，不重建组件"""
+        if self.is_expanded:
+            self.save_card(show_message=False)
+            self.close_editor()
+        self.note_data = note_data
+        self.update_preview()
         
-        preview_frame = tk.Frame(self, bg="#ffffff")
-        preview_frame.pack(fill=tk.BOTH, expand=True, padx=12, pady=8)
+    def unbind_note(self):
+        """便签已被删除：丢弃编辑内容，卡片回到池中"""
+        if self.is_expanded:
+            self.close_editor()
+        self.note_data = None
+        
+    def create_preview(self):
+        """创建预览模式的组件（每个卡片只创建一次）"""
+        self.preview_frame = tk.Frame(self, bg="#ffffff")
+        self.preview_frame.pack(fill=tk.BOTH, expand=True, padx=12, pady=8)
         
         # 顶部行
-        top_row = tk.Frame(preview_frame, bg="#ffffff")
-        top_row.pack(fill=tk.X, pady=(0, 6))
+        self.top_row = tk.Frame(self.preview_frame, bg="#ffffff")
+        self.top_row.pack(fill=tk.X, pady=(0, 6))
+        
+        # 拖动手柄 - 按住上下拖动调整顺序
+        self.drag_handle = tk.Label(
+            self.top_row,
+            text="⠿",
+            font=self.app.get_font(10),
+            fg="#bdc3c7",
+            bg="#ffffff",
+            cursor="fleur",
+            padx=0
+        )
+        self.drag_handle.pack(side=tk.LEFT, padx=(0, 4))
+        self.drag_handle.bind("<ButtonPress-1>", lambda e: self.app.start_drag(self, e))
+        self.drag_handle.bind("<B1-Motion>", self.app.drag_motion)
+        self.drag_handle.bind("<ButtonRelease-1>", self.app.end_drag)
         
         # 分类标签
-        category = self.note_data.get("category", "常用")
-        color = self.category_colors.get(category, "#607D8B")
-        
-        category_frame = tk.Frame(top_row, bg=color)
-        category_frame.pack(side=tk.LEFT, padx=(0, 8))
+        self.category_frame = tk.Frame(self.top_row)
+        self.category_frame.pack(side=tk.LEFT, padx=(0, 8))
         
-        tk.Label(
-            category_frame,
-            text=f" {category} ",
-            bg=color,
+        self.category_label = tk.Label(
+            self.category_frame,
+            font=self.app.get_font(8, "bold"),
             fg="white",
-            font=("Microsoft YaHei", self.get_scaled_font_size(8), "bold"),
             padx=6,
             pady=2
-        ).pack()
+        )
+        self.category_label.pack()
         
         # 标题
-        title = self.note_data.get("title", "未命名")
         self.title_label = tk.Label(
-            top_row,
-            text=title,
-            font=("Microsoft YaHei", self.get_scaled_font_size(10), "bold"),
+            self.top_row,
+            font=self.app.get_font(10, "bold"),
             fg="#2c3e50",
             bg="#ffffff",
             anchor=tk.W
@@ -79,9 +224,9 @@ class NoteCard(tk.Frame):
         
         # 删除按钮 - 独立处理
         self.delete_btn = tk.Label(
-            top_row,
+            self.top_row,
             text="✕",
-            font=("Arial", self.get_scaled_font_size(14)),
+            font=self.app.get_font(14, family="Arial"),
             fg="#95a5a6",
             bg="#ffffff",
             cursor="hand2",
@@ -94,45 +239,106 @@ class NoteCard(tk.Frame):
         self.delete_btn.bind("<Enter>", lambda e: self.delete_btn.config(fg="#e74c3c"))
         self.delete_btn.bind("<Leave>", lambda e: self.delete_btn.config(fg="#95a5a6"))
         
-        # 内容预览
-        content = self.note_data.get("content", "")
-        if content:
-            preview_text = content[:100] + "..." if len(content) > 100 else content
-            
-            self.content_label = tk.Label(
-                preview_frame,
-                text=preview_text,
-                font=("Microsoft YaHei", self.get_scaled_font_size(9)),
-                fg="#7f8c8d",
-                bg="#ffffff",
-                justify=tk.LEFT,
-                anchor=tk.W,
-                wraplength=int(420 * self.app.font_scale)
-            )
-            self.content_label.pack(fill=tk.X, pady=(0, 4))
-        else:
-            self.content_label = tk.Label(
-                preview_frame,
-                text="点击编辑内容...",
-                font=("Microsoft YaHei", self.get_scaled_font_size(9)),
-                fg="#bdc3c7",
-                bg="#ffffff"
-            )
-            self.content_label.pack(fill=tk.X, pady=(0, 4))
+        # 复制按钮 - 直接复制便签内容，无需展开编辑
+        self.copy_btn = tk.Label(
+            self.top_row,
+            text="📋",
+            font=self.app.get_font(10),
+            fg="#27ae60",
+            bg="#ffffff",
+            cursor="hand2",
+            padx=3
+        )
+        self.copy_btn.pack(side=tk.RIGHT)
+        self.copy_btn.bind("<Button-1>", self.on_copy_click)
+        self.copy_btn.bind("<Enter>", lambda e: self.copy_btn.config(fg="#2ecc71"))
+        self.copy_btn.bind("<Leave>", lambda e: self.copy_btn.config(fg="#27ae60"))
+        
+        # 置顶按钮 - 置顶的便签固定在列表最前
+        self.pin_btn = tk.Label(
+            self.top_row,
+            text="📌",
+            font=self.app.get_font(10),
+            bg="#ffffff",
+            cursor="hand2",
+            padx=3
+        )
+        self.pin_btn.pack(side=tk.RIGHT)
+        self.pin_btn.bind("<Button-1>", self.on_pin_click)
+        
+        # 内容预览 - 固定两行高度，使所有折叠卡片等高，便于虚拟列表定位
+        self.content_label = tk.Label(
+            self.preview_frame,
+            font=self.app.get_font(9),
+            bg="#ffffff",
+            justify=tk.LEFT,
+            anchor=tk.NW,
+            height=2
+        )
+        self.content_label.pack(fill=tk.X, pady=(0, 4))
         
         # 卡片其他区域点击展开
-        preview_frame.bind("<Button-1>", lambda e: self.expand_card())
-        top_row.bind("<Button-1>", lambda e: self.expand_card())
-        category_frame.bind("<Button-1>", lambda e: self.expand_card())
-        self.title_label.bind("<Button-1>", lambda e: self.expand_card())
-        self.content_label.bind("<Button-1>", lambda e: self.expand_card())
-        
-        # 设置光标
-        preview_frame.config(cursor="hand2")
-        top_row.config(cursor="hand2")
-        category_frame.config(cursor="hand2")
-        self.title_label.config(cursor="hand2")
-        self.content_label.config(cursor="hand2")
+        for widget in (self.preview_frame, self.top_row, self.category_frame,
+                       self.category_label, self.title_label, self.content_label):
+            widget.bind("<Button-1>", lambda e: self.expand_card())
+            widget.bind("<Control-Button-1>", self.on_select_click)
+            widget.config(cursor="hand2")
+        
+        self.update_fonts()
+        
+    def preview_data(self):
+        """取预览数据（截断文本、颜色），只在内容变化时重新计算"""
+        note_id = self.note_data.id
+        content = self.note_data.content
+        cached = self.app.preview_cache.get(note_id)
+        if cached is None or cached[0] != content:
+            if content:
+                text = content[:100] + "..." if len(content) > 100 else content
+                fg = "#7f8c8d"
+            else:
+                text = "点击编辑内容..."
+                fg = "#bdc3c7"
+            cached = (content, text, fg)
+            self.app.preview_cache[note_id] = cached
+        return cached
+        
+    def update_preview(self):
+        """用当前便签数据刷新预览内容"""
+        category = self.note_data.category
+        color = self.category_colors.get(category, "#607D8B")
+        self.category_frame.config(bg=color)
+        self.category_label.config(text=f" {category} ", bg=color)
+        
+        self.title_label.config(text=self.note_data.title or "未命名")
+        self.pin_btn.config(fg="#e74c3c" if self.note_data.pinned else "#d5d8dc")
+        
+        preview = self.preview_data()
+        if preview is not self.shown_preview:
+            self.content_label.config(text=preview[1], fg=preview[2])
+            self.shown_preview = preview
+        self.update_highlight()
+        
+    def update_highlight(self):
+        """选中（待加入复制队列）的卡片显示橙色边框"""
+        if self.is_expanded:
+            return
+        if self.note_id in self.app.selected_ids:
+            self.configure(highlightbackground="#f39c12", highlightthickness=2)
+        else:
+            self.configure(highlightbackground="#ddd", highlightthickness=1)
+            
+    def on_select_click(self, event):
+        """Ctrl+单击：选中/取消选中，不展开"""
+        self.app.toggle_selection(self.note_id)
+        return "break"
+        
+    def on_copy_click(self, event):
+        self.app.copy_note(self.note_data)
+        return "break"
+        
+    def on_pin_click(self, event):
+        self.app.toggle_pin(self.note_data)
+        return "break"
         
     def on_delete_click(self, event):
         """删除按钮点击事件"""
@@ -140,13 +346,14 @@ class NoteCard(tk.Frame):
         return "break"  # 阻止事件传播
         
     def create_expanded(self):
-        """创建展开模式"""
-        for widget in self.winfo_children():
-            widget.destroy()
+        """创建展开模式（编辑组件只在展开时创建）"""
+        if self.edit_frame is not None:
+            self.edit_frame.destroy()
+        self.preview_frame.pack_forget()
         
         self.configure(highlightbackground="#3498db", highlightthickness=2)
         
-        edit_frame = tk.Frame(self, bg="#ffffff")
+        edit_frame = self.edit_frame = tk.Frame(self, bg="#ffffff")
         edit_frame.pack(fill=tk.BOTH, expand=True, padx=12, pady=8)
         
         # 顶部：分类 + 复制 + 关闭
@@ -156,18 +363,20 @@ class NoteCard(tk.Frame):
         tk.Label(
             top_bar,
             text="分类",
-            font=("Microsoft YaHei", self.get_scaled_font_size(8)),
+            font=self.app.get_font(8),
             fg="#7f8c8d",
             bg="#ffffff"
         ).pack(side=tk.LEFT, padx=(0, 5))
         
-        self.category_var = tk.StringVar(value=self.note_data.get("category", "常用"))
+        self.edit_start = self.editor_values_of(self.note_data)
+        self.category_var = tk.StringVar(value=self.note_data.category)
+        self.category_var.trace_add("write", self.on_modified)
         ttk.Combobox(
             top_bar,
+            font=self.app.get_font(8),
             textvariable=self.category_var,
             values=list(self.category_colors.keys()),
             width=8,
-            font=("Microsoft YaHei", self.get_scaled_font_size(8)),
             state="readonly"
         ).pack(side=tk.LEFT)
         
@@ -175,7 +384,7 @@ class NoteCard(tk.Frame):
         copy_btn = tk.Label(
             top_bar,
             text="📋 复制",
-            font=("Microsoft YaHei", self.get_scaled_font_size(9)),
+            font=self.app.get_font(9),
             fg="#27ae60",
             bg="#ffffff",
             cursor="hand2",
@@ -183,16 +392,7 @@ class NoteCard(tk.Frame):
         )
         copy_btn.pack(side=tk.RIGHT, padx=(0, 15))
         
-        def copy_content(e):
-            content = self.content_text.get("1.0", tk.END).strip()
-            if content:
-                self.app.root.clipboard_clear()
-                self.app.root.clipboard_append(content)
-                self.app.show_status("✓ 已复制全部内容")
-            else:
-                self.app.show_status("内容为空")
-        
-        copy_btn.bind("<Button-1>", copy_content)
+        copy_btn.bind("<Button-1>", lambda e: self.app.copy_note(self.note_data))
         copy_btn.bind("<Enter>", lambda e: copy_btn.config(fg="#2ecc71"))
         copy_btn.bind("<Leave>", lambda e: copy_btn.config(fg="#27ae60"))
         
@@ -200,7 +400,7 @@ class NoteCard(tk.Frame):
         close_btn = tk.Label(
             top_bar,
             text="✕ 关闭",
-            font=("Microsoft YaHei", self.get_scaled_font_size(9)),
+            font=self.app.get_font(9),
             fg="#7f8c8d",
             bg="#ffffff",
             cursor="hand2"
@@ -214,27 +414,29 @@ class NoteCard(tk.Frame):
         tk.Label(
             edit_frame,
             text="标题",
-            font=("Microsoft YaHei", self.get_scaled_font_size(8)),
+            font=self.app.get_font(8),
             fg="#7f8c8d",
             bg="#ffffff"
         ).pack(anchor=tk.W, pady=(0, 3))
         
+        self.title_var = tk.StringVar(value=self.note_data.title)
+        self.title_var.trace_add("write", self.on_modified)
         self.title_entry = tk.Entry(
             edit_frame,
-            font=("Microsoft YaHei", self.get_scaled_font_size(10)),
+            textvariable=self.title_var,
+            font=self.app.get_font(10),
             relief=tk.FLAT,
             bg="#f8f9fa",
             fg="#2c3e50",
             insertbackground="#3498db"
         )
-        self.title_entry.insert(0, self.note_data.get("title", ""))
         self.title_entry.pack(fill=tk.X, pady=(0, 8))
         
         # 内容
         tk.Label(
             edit_frame,
             text="内容",
-            font=("Microsoft YaHei", self.get_scaled_font_size(8)),
+            font=self.app.get_font(8),
             fg="#7f8c8d",
             bg="#ffffff"
         ).pack(anchor=tk.W, pady=(0, 3))
@@ -247,7 +449,7 @@ class NoteCard(tk.Frame):
         
         self.content_text = tk.Text(
             text_container,
-            font=("Microsoft YaHei", self.get_scaled_font_size(9)),
+            font=self.app.get_font(9),
             wrap=tk.WORD,
             relief=tk.FLAT,
             bg="#f8f9fa",
@@ -260,15 +462,17 @@ class NoteCard(tk.Frame):
             yscrollcommand=scrollbar.set,
             height=8
         )
-        self.content_text.insert("1.0", self.note_data.get("content", ""))
+        self.content_text.insert("1.0", self.note_data.content)
+        self.content_text.edit_modified(False)
+        self.content_text.bind("<<Modified>>", self.on_content_modified)
         self.content_text.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
         scrollbar.config(command=self.content_text.yview)
         
         # 提示
         tk.Label(
             edit_frame,
-            text="💡 Ctrl+C 复制选中 | Ctrl+A 全选 | 点击外部自动保存",
-            font=("Microsoft YaHei", self.get_scaled_font_size(7)),
+            text="💡 Ctrl+C 复制选中 | Ctrl+A 全选 | 输入时自动保存",
+            font=self.app.get_font(7),
             fg="#95a5a6",
             bg="#ffffff"
         ).pack(anchor=tk.E, pady=(6, 0))
@@ -277,57 +481,159 @@ class NoteCard(tk.Frame):
         if not self.is_expanded:
             self.is_expanded = True
             self.create_expanded()
-            self.app.collapse_other_cards(self.index)
+            self.app.collapse_other_cards(self.note_id)
+            self.app.update_layout()
             
     def collapse_card(self):
         if self.is_expanded:
             self.save_card(show_message=False)
-            self.is_expanded = False
-            self.configure(highlightbackground="#ddd", highlightthickness=1)
-            self.create_preview()
+            self.close_editor()
+            self.app.update_layout()
+            
+    def close_editor(self):
+        """销毁编辑组件，恢复预览"""
+        self.is_expanded = False
+        if self.edit_frame is not None:
+            self.edit_frame.destroy()
+            self.edit_frame = None
+        self.configure(highlightbackground="#ddd", highlightthickness=1)
+        self.update_preview()
+        self.preview_frame.pack(fill=tk.BOTH, expand=True, padx=12, pady=8)
+            
+    @staticmethod
+    def editor_values_of(note):
+        return {"title": note.title, "content": note.content, "category": note.category}
+        
+    def editor_values(self):
+        return {
+            "title": self.title_var.get() or "未命名",
+            "content": self.content_text.get("1.0", tk.END).strip(),
+            "category": sys.intern(self.category_var.get()),
+        }
+        
+    def on_modified(self, *args):
+        """标题、内容或分类被修改：标记为待保存，由界面空闲时统一写入"""
+        if self.is_expanded and self.note_data is not None:
+            self.app.mark_dirty(self.note_data.id)
+            
+    def on_content_modified(self, event):
+        # Text 的 <<Modified>> 只在修改标志从假变真时触发一次，需要手动复位
+        if self.content_text.edit_modified():
+            self.content_text.edit_modified(False)
+            self.on_modified()
+        
+    def autosave(self):
+        """写入编辑中的内容，但不记入撤销历史（收起时整段编辑合并为一条记录）"""
+        if self.is_expanded:
+            self.app.autosave_note(self.note_data, self.editor_values())
             
     def save_card(self, show_message=True):
         if self.is_expanded:
-            self.note_data["title"] = self.title_entry.get() or "未命名"
-            self.note_data["content"] = self.content_text.get("1.0", tk.END).strip()
-            self.note_data["category"] = self.category_var.get()
-            self.app.save_data()
+            values = self.editor_values()
+            self.app.edit_note(self.note_data, values, self.edit_start)
+            self.edit_start = values
             if show_message:
-                self.app.show_status(f"✓ 已保存: {self.note_data['title']}")
+                self.app.show_status(f"✓ 已保存: {self.note_data.title}")
                 
     def delete_card(self):
-        title = self.note_data.get("title", "未命名")
-        if messagebox.askyesno("确认删除", f"确定要删除便签 '{title}' 吗?"):
-            self.app.delete_note(self.index)
+        # 不再弹出确认对话框：删除后显示可撤销的提示条，并可从回收站恢复
+        self.app.delete_note(self.note_id)
                 
     def update_fonts(self):
-        if self.is_expanded:
-            self.create_expanded()
-        else:
-            self.create_preview()
+        """字体由共享的字体对象自动更新，这里只需调整预览的换行宽度"""
+        self.content_label.config(wraplength=int(420 * self.app.font_scale))
 
 
 class StickyNotesCardApp:
     """极简卡片式便签应用"""
-    def __init__(self, root):
+    card_gap = 8       # 卡片间距
+    overscan = 3       # 可见区域上下额外绑定的卡片数
+    
+    # 以下数据属于当前笔记本，切换笔记本时随之替换
+    notes = notebook_attribute("notes")
+    notes_by_id = notebook_attribute("notes_by_id")
+    preview_cache = notebook_attribute("preview_cache")
+    order = notebook_attribute("order")
+    front_order = notebook_attribute("front_order")
+    search_index = notebook_attribute("search_index")
+    category_ids = notebook_attribute("category_ids")
+    index_queue = notebook_attribute("index_queue")
+    index_position = notebook_attribute("index_position")
+    known_ids = notebook_attribute("known_ids")
+    history = notebook_attribute("history")
+    trash = notebook_attribute("trash")
+    loading = notebook_attribute("loading")
+    store = notebook_attribute("store")
+    
+    def __init__(self, root, timing=False, profile=False):
         self.root = root
         self.root.title("📝 便签工具")
         
-        self.data_file = "sticky_notes_data.json"
-        self.config_file = "window_config.json"
-        
-        self.notes = []
-        self.cards = []
+        # 必须在绑定事件之前替换为计时版本
+        self.profiler = None
+        self.profiler_panel = None
+        if profile:
+            self.enable_profiler()
+        
+        self.data_file = DATA_FILE
+        self.config_file = CONFIG_FILE
+        self.manifest_file = MANIFEST_FILE
+        
+        self.config = load_config(self.config_file)
+        self.store_class = STORAGE_BACKENDS.get(self.config.get("storage"), JournalStore)
+        self.manifest = NotebookManifest(self.manifest_file, self.data_file)
+        self.loaded_notebooks = OrderedDict()  # 名称 -> 已读入内存的笔记本，最近使用的在后
+        self.max_loaded_notebooks = max(1, int(self.config.get("loaded_notebooks", 3)))
+        self.autosave_delay = max(100, int(self.config.get("autosave_ms", 1000)))
+        self.notebook = None
+        self.notebook = self.open_notebook(self.manifest.active)
+        
+        self.cards = []              # 卡片池，数量只与可见区域大小有关
+        self.view = self.notes       # 当前显示的便签（搜索时为过滤后的列表）
+        self.category_filter = None  # 当前筛选的分类，None 表示全部
+        self.category_chips = {}
+        self.visible_cards = {}      # 便签 id -> 当前绑定的卡片
+        self.free_cards = []
+        self.row_height = None       # 折叠卡片高度（所有折叠卡片等高）
+        self.expanded_id = None
+        self.expanded_index = None
+        self.expanded_height = 0
         self.font_scale = 1.0
+        self.fonts = {}              # (字体, 基准字号, 粗细) -> 所有卡片共享的字体对象
         self.last_width = 0
-        
-        self.load_data()
+        self.resize_job = None
+        self.pending_width = 0
+        self.timing = timing
+        self.clipboard_history = deque(maxlen=20)  # 最近复制的内容，最新的在前
+        self.selected_ids = []       # Ctrl+单击选中的便签，按选择顺序
+        self.copy_queue = []         # 依次复制的便签 id
+        self.copy_queue_position = 0
+        self.reloading = False       # 正在后台读取其他实例写入的修改
+        self.dirty_ids = set()       # 编辑中尚未写入的便签
+        self.autosave_job = None
+        self.drag = None             # 正在拖动的卡片及起始位置
+        self.server = None
+        self.command_queue = queue.Queue()  # 命令服务线程交给界面线程执行的命令
+        
+        # 分阶段启动：先显示窗口、工具栏和状态栏，再在后台读取数据
         self.load_window_config()
         self.setup_window()
         self.create_ui()
+        self.count_label.config(text="加载中...")
         
         self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
         self.root.bind("<Configure>", self.on_window_resize)
+        self.root.update()
+        self.report_startup("首次显示")
+        
+        self.load_data(self.notebook)
+        self.poll_save_errors()
+        if self.config.get("watch", True):
+            self.root.after(1000, self.watch_files)
+        if self.profiler is not None:
+            self.profiler.start_heartbeat(self.root)
+        if self.config.get("server", True):
+            self.start_server()
         
     def setup_window(self):
         self.root.attributes("-topmost", True)
@@ -383,6 +689,20 @@ class StickyNotesCardApp:
             widget.bind("<Enter>", lambda e: on_new_hover(True))
             widget.bind("<Leave>", lambda e: on_new_hover(False))
         
+        # 笔记本切换
+        self.notebook_btn = tk.Label(
+            toolbar_inner,
+            text=f"📒 {self.notebook.name} ▾",
+            font=("Microsoft YaHei", 9),
+            fg="#2c3e50",
+            bg="#f8f9fa",
+            cursor="hand2",
+            padx=8,
+            pady=4
+        )
+        self.notebook_btn.pack(side=tk.LEFT, padx=(0, 15))
+        self.notebook_btn.bind("<Button-1>", lambda e: self.show_notebook_menu())
+        
         # 透明度
         alpha_frame = tk.Frame(toolbar_inner, bg="#ffffff")
         alpha_frame.pack(side=tk.LEFT)
@@ -416,6 +736,87 @@ class StickyNotesCardApp:
         )
         self.count_label.pack(side=tk.RIGHT)
         
+        # 搜索框
+        search_row = tk.Frame(toolbar, bg="#ffffff")
+        search_row.pack(fill=tk.X, padx=15, pady=(0, 10))
+        
+        tk.Label(
+            search_row,
+            text="🔍",
+            font=("Microsoft YaHei", 9),
+            fg="#7f8c8d",
+            bg="#ffffff"
+        ).pack(side=tk.LEFT, padx=(0, 6))
+        
+        self.search_var = tk.StringVar()
+        self.search_entry = tk.Entry(
+            search_row,
+            textvariable=self.search_var,
+            font=("Microsoft YaHei", 9),
+            relief=tk.FLAT,
+            bg="#f8f9fa",
+            fg="#2c3e50",
+            insertbackground="#3498db"
+        )
+        self.search_entry.pack(side=tk.LEFT, fill=tk.X, expand=True, ipady=3)
+        self.search_entry.bind("<Escape>", lambda e: self.search_var.set(""))
+        self.search_var.trace_add("write", lambda *args: self.apply_search())
+        
+        # 复制队列和剪贴板历史
+        self.queue_btn = tk.Label(
+            search_row,
+            text="⏭ 队列",
+            font=("Microsoft YaHei", 9),
+            fg="#e67e22",
+            bg="#ffffff",
+            cursor="hand2",
+            padx=6
+        )
+        self.queue_btn.pack(side=tk.RIGHT)
+        self.queue_btn.bind("<Button-1>", lambda e: self.on_queue_click())
+        self.queue_btn.bind("<Button-3>", lambda e: self.clear_copy_queue())
+        
+        history_btn = tk.Label(
+            search_row,
+            text="🕘 历史",
+            font=("Microsoft YaHei", 9),
+            fg="#27ae60",
+            bg="#ffffff",
+            cursor="hand2",
+            padx=6
+        )
+        history_btn.pack(side=tk.RIGHT, padx=(8, 0))
+        history_btn.bind("<Button-1>", lambda e: self.show_clipboard_history(history_btn))
+        
+        file_btn = tk.Label(
+            search_row,
+            text="📁",
+            font=("Microsoft YaHei", 9),
+            fg="#7f8c8d",
+            bg="#ffffff",
+            cursor="hand2",
+            padx=4
+        )
+        file_btn.pack(side=tk.RIGHT, padx=(8, 0))
+        file_btn.bind("<Button-1>", lambda e: self.show_file_menu(file_btn))
+        
+        # 分类筛选
+        chip_row = tk.Frame(toolbar, bg="#ffffff")
+        chip_row.pack(fill=tk.X, padx=15, pady=(0, 10))
+        
+        for category in (None,) + tuple(NoteCard.category_colors):
+            chip = tk.Label(
+                chip_row,
+                font=("Microsoft YaHei", 8),
+                cursor="hand2",
+                padx=6,
+                pady=1
+            )
+            chip.pack(side=tk.LEFT, padx=(0, 4))
+            chip.bind("<Button-1>", lambda e, c=category: self.set_category_filter(c))
+            self.category_chips[category] = chip
+        self.update_chips()
+        
         # 卡片区域
         canvas_container = tk.Frame(main_frame, bg="#ecf0f1")
         canvas_container.pack(fill=tk.BOTH, expand=True)
@@ -423,22 +824,51 @@ class StickyNotesCardApp:
         self.canvas = tk.Canvas(canvas_container, bg="#ecf0f1", highlightthickness=0, bd=0)
         scrollbar = ttk.Scrollbar(canvas_container, orient=tk.VERTICAL, command=self.canvas.yview)
         
-        self.scrollable_frame = tk.Frame(self.canvas, bg="#ecf0f1")
-        
-        self.canvas_window = self.canvas.create_window(
-            (0, 0),
-            window=self.scrollable_frame,
-            anchor=tk.NW,
-            width=self.canvas.winfo_reqwidth()
+        # 卡片直接作为画布窗口项按计算出的位置摆放，只渲染可见部分
+        self.empty_hint = self.canvas.create_text(
+            0, 100,
+            text="📝 点击\"新建\"开始使用",
+            font=("Microsoft YaHei", 12),
+            fill="#bdc3c7",
+            anchor=tk.N,
+            state=tk.HIDDEN
         )
         
-        self.scrollable_frame.bind("<Configure>", lambda e: self.canvas.configure(scrollregion=self.canvas.bbox("all")))
-        self.canvas.configure(yscrollcommand=scrollbar.set)
+        def on_canvas_scroll(first, last):
+            scrollbar.set(first, last)
+            self.render_visible()
+        
+        self.canvas.configure(yscrollcommand=on_canvas_scroll)
+        self.canvas.bind("<Configure>", self.on_canvas_configure)
         
         self.canvas.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
         scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
         
-        self.canvas.bind_all("<MouseWheel>", lambda e: self.canvas.yview_scroll(int(-1*(e.delta/120)), "units"))
+        # 可撤销操作的提示条，显示时浮在卡片区域底部
+        self.toast = tk.Frame(canvas_container, bg="#2c3e50")
+        self.toast_label = tk.Label(
+            self.toast,
+            font=("Microsoft YaHei", 9),
+            fg="white",
+            bg="#2c3e50",
+            padx=12,
+            pady=6
+        )
+        self.toast_label.pack(side=tk.LEFT)
+        self.toast_action = tk.Label(
+            self.toast,
+            font=("Microsoft YaHei", 9, "bold"),
+            fg="#f1c40f",
+            bg="#2c3e50",
+            cursor="hand2",
+            padx=12
+        )
+        self.toast_action.pack(side=tk.LEFT)
+        self.toast_action.bind("<Button-1>", lambda e: self.on_toast_click())
+        self.toast_job = None
+        self.toast_callback = None
+        
+        self.canvas.bind_all("<MouseWheel>", lambda e: self.on_mouse_wheel(e))
         
         # 状态栏
         status_bar = tk.Frame(main_frame, bg="#ffffff")
@@ -458,7 +888,18 @@ class StickyNotesCardApp:
         
         # 快捷键
         self.root.bind('<Control-n>', lambda e: self.new_note())
+        self.root.bind('<Control-f>', lambda e: self.search_entry.focus_set())
         self.root.bind('<Control-q>', lambda e: self.on_closing())
+        self.root.bind('<F2>', lambda e: self.on_queue_click())
+        self.root.bind('<Control-z>', lambda e: self.on_undo_key())
+        self.root.bind('<Control-y>', lambda e: self.on_undo_key(redo=True))
+        self.root.bind('<Control-Z>', lambda e: self.on_undo_key(redo=True))  # Ctrl+Shift+Z
+        self.root.bind('<Delete>', lambda e: self.on_delete_key())
+        for number in range(1, 10):
+            self.root.bind(f'<Control-Key-{number}>', lambda e, n=number: self.copy_nth(n))
+        if self.profiler is not None:
+            self.root.bind('<Control-Shift-D>', lambda e: self.toggle_profiler_panel())
+            self.root.bind('<Control-Shift-S>', lambda e: self.dump_profile())
         
         self.refresh_cards()
         
@@ -471,131 +912,1388 @@ class StickyNotesCardApp:
         else:
             return max(1.0, width / base_width)
     
+    def on_mouse_wheel(self, event):
+        self.canvas.yview_scroll(int(-1*(event.delta/120)), "units")
+        
+    def scaled_font_size(self, base_size):
+        """计算缩放字体，但保持最小值"""
+        scaled = int(base_size * self.font_scale)
+        min_sizes = {7: 7, 8: 8, 9: 9, 10: 10, 11: 11}
+        return max(scaled, min_sizes.get(base_size, base_size))
+        
+    def get_font(self, base_size, weight="normal", family="Microsoft YaHei"):
+        """取共享字体对象，同一基准字号和粗细只创建一个"""
+        key = (family, base_size, weight)
+        font = self.fonts.get(key)
+        if font is None:
+            font = tkfont.Font(root=self.root, family=family,
+                               size=self.scaled_font_size(base_size), weight=weight)
+            self.fonts[key] = font
+        return font
+        
     def on_window_resize(self, event):
+        # 拖动调整大小时会连续产生事件，合并为 100ms 后处理一次
         if event.widget == self.root:
-            canvas_width = self.canvas.winfo_width()
-            if canvas_width > 1:
-                self.canvas.itemconfig(self.canvas_window, width=canvas_width)
-            
-            new_width = event.width
-            if abs(new_width - self.last_width) > 50:
-                self.last_width = new_width
-                old_scale = self.font_scale
-                self.font_scale = self.calculate_font_scale(new_width)
+            self.pending_width = event.width
+            if self.resize_job is None:
+                self.resize_job = self.root.after(100, self.apply_resize)
                 
-                if abs(old_scale - self.font_scale) > 0.05:
-                    for card in self.cards:
-                        card.update_fonts()
+    def apply_resize(self):
+        self.resize_job = None
+        new_width = self.pending_width
+        if abs(new_width - self.last_width) > 50:
+            self.last_width = new_width
+            old_scale = self.font_scale
+            self.font_scale = self.calculate_font_scale(new_width)
+            
+            if abs(old_scale - self.font_scale) > 0.05:
+                # 只需重设几个共享字体的字号，Tk 会自动更新所有使用它们的组件
+                for (family, base_size, weight), font in self.fonts.items():
+                    font.configure(size=self.scaled_font_size(base_size))
+                for card in self.cards:
+                    card.update_fonts()
+                self.row_height = None
+                self.update_layout()
+                    
+    def on_canvas_configure(self, event):
+        """画布尺寸变化时调整卡片宽度并补齐可见卡片"""
+        for card in self.cards:
+            self.canvas.itemconfig(card.canvas_item, width=event.width)
+        self.canvas.coords(self.empty_hint, event.width / 2, 100)
+        self.update_scrollregion()
+        self.render_visible()
         
     def new_note(self):
-        note = {
-            "title": f"新便签 {len(self.notes) + 1}",
-            "content": "",
-            "category": "常用",
-            "created_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        }
-        self.notes.insert(0, note)  # 插入到列表开头
-        self.save_data()
-        self.refresh_cards()
+        if self.loading:
+            self.show_status("正在加载数据，请稍候...")
+            return
+        note = self.create_note(category=self.category_filter or "常用")  # 筛选时新建到当前分类
         
         # 滚动到顶部显示新便签
         self.canvas.yview_moveto(0)
         
-        if self.cards:
-            self.cards[0].expand_card()
+        card = self.visible_cards.get(note.id)
+        if card is not None:
+            card.expand_card()
         
         self.show_status("✨ 已创建新便签")
         
-    def delete_note(self, index):
-        if 0 <= index < len(self.notes):
-            title = self.notes[index]["title"]
-            del self.notes[index]
-            self.save_data()
-            self.refresh_cards()
-            self.show_status(f"🗑️ 已删除: {title}")
+    def create_note(self, title=None, content="", category="常用"):
+        """新建便签放在列表最前，写入存储并记入撤销历史"""
+        note = Note(
+            id=uuid.uuid4().hex,
+            title=title or f"新便签 {len(self.notes) + 1}",
+            content=content,
+            category=category,
+            created=Note.now(),
+            rev=1
+        )
+        index = self.notebook.pinned_count()  # 新便签放在置顶便签之后
+        self.add_note(note, index)
+        if self.view is not self.notes:
+            self.view.insert(0, note)  # 搜索或筛选时新便签也显示在最前
+            self.insert_card(0)
+        self.store.put(note, index=index)
+        self.history.record(("insert", [(index, note)]))
+        return note
+        
+    def add_note(self, note, index=0):
+        """把便签插入到 index 处并更新各索引；显示全部时只为它绑定一张卡片"""
+        index = self.notebook.insert(note, index)
+        if self.view is self.notes:
+            self.insert_card(index)
             
-    def collapse_other_cards(self, current_index):
-        for i, card in enumerate(self.cards):
-            if i != current_index and card.is_expanded:
-                card.collapse_card()
-                
-    def refresh_cards(self):
-        # 清除scrollable_frame中的所有子组件（包括提示文字）
-        for widget in self.scrollable_frame.winfo_children():
-            widget.destroy()
-        self.cards.clear()
+    def delete_note(self, note_id):
+        self.delete_notes([note_id])
+        
+    def delete_notes(self, note_ids):
+        """删除便签：移入回收站并记入撤销历史，用可撤销的提示条代替确认对话框"""
+        entries = self.remove_notes(note_ids)
+        if not entries:
+            return
+        for index, note in entries:
+            self.store.delete(note.id)
+        self.trash_notes([note for index, note in entries])
+        self.history.record(("delete", entries))
+        if len(entries) == 1:
+            message = f"🗑️ 已删除: {entries[0][1].title}"
+        else:
+            message = f"🗑️ 已删除 {len(entries)} 条便签"
+        self.show_toast(message, "撤销", self.undo)
         
-        for i, note in enumerate(self.notes):
-            card = NoteCard(self.scrollable_frame, note, i, self)
-            card.pack(fill=tk.BOTH, expand=True, pady=4)
-            self.cards.append(card)
+    def delete_selected(self):
+        if self.selected_ids:
+            self.delete_notes(list(self.selected_ids))
+            
+    def remove_notes(self, note_ids):
+        """移除便签并返回 [(原位置, 便签)]；多条时列表和分类索引各重建一次，卡片列表只刷新一次"""
+        if len(note_ids) == 1:
+            note = self.notes_by_id.get(note_ids[0])
+            if note is None:
+                return []
+            index = self.notes.index(note)
+            self.forget_note(note.id)
+            return [(index, note)]
+        
+        removing = set(note_ids)
+        for note_id in removing:
+            card = self.visible_cards.pop(note_id, None)
+            if card is not None:
+                card.unbind_note()  # 丢弃编辑内容，不能再保存
+                self.free_cards.append(card)
+        entries = self.notebook.remove_many(removing)
+        if self.view is not self.notes:
+            self.view = [note for note in self.view if note.id not in removing]
+        self.selected_ids = [i for i in self.selected_ids if i not in removing]
+        self.update_queue_button()
+        self.refresh_cards()
+        return entries
         
-        if hasattr(self, 'count_label'):
+    def restore_notes(self, entries):
+        """把删除的便签放回原来的位置，entries 为按位置升序的 [(位置, 便签)]"""
+        if len(entries) == 1:
+            index, note = entries[0]
+            self.add_note(note, index)
+        else:
+            self.notebook.restore_many(entries)
+            if self.view is self.notes:
+                self.refresh_cards()
+        if self.view is not self.notes:
+            self.apply_search()
+            
+    def trash_notes(self, notes):
+        try:
+            self.trash.add(notes)
+        except OSError as e:
+            self.show_status(f"⚠ 写入回收站失败: {e}")
+            
+    def forget_note(self, note_id):
+        """从列表和各索引中移除便签，只回收它对应的卡片"""
+        note = self.notes_by_id.get(note_id)
+        if note is not None:
+            view_index = self.view_index(note)
+            self.notebook.remove(note_id)
+            if self.view is not self.notes and view_index is not None:
+                del self.view[view_index]
+            if note_id in self.selected_ids:
+                self.selected_ids.remove(note_id)
+                self.update_queue_button()
+            if view_index is not None:
+                self.remove_card(note_id, view_index)
+            else:
+                self.update_count()
+        return note
+        
+    def edit_note(self, note, values, original=None):
+        """保存编辑：只有变化的字段才写入存储并记入撤销历史，返回是否有变化
+        
+        original 为开始编辑时的值；自动保存已写入过一部分修改时，撤销记录仍从这里算起。
+        """
+        self.dirty_ids.discard(note.id)
+        changed = {field: value for field, value in values.items() if getattr(note, field) != value}
+        old = self.update_note(note, changed) if changed else {}
+        if original is not None:
+            old = {field: original[field] for field in values if original[field] != values[field]}
+        if old:
+            self.history.record(("edit", note.id, old, {field: values[field] for field in old}))
+        return bool(old)
+        
+    def autosave_note(self, note, values):
+        changed = {field: value for field, value in values.items() if getattr(note, field) != value}
+        if changed:
+            self.update_note(note, changed)
+            
+    def mark_dirty(self, note_id):
+        """输入时只记下便签 id；约一秒后在界面空闲时写入所有待保存的便签"""
+        self.dirty_ids.add(note_id)
+        if self.autosave_job is None:
+            self.autosave_job = self.root.after(
+                self.autosave_delay, lambda: self.root.after_idle(self.flush_dirty))
+            
+    def flush_dirty(self):
+        # 写入经存储层合并：日志/SQLite 只追加这几条便签，后台线程再合并短时间内的多次写入
+        self.autosave_job = None
+        dirty, self.dirty_ids = self.dirty_ids, set()
+        for note_id in dirty:
+            card = self.visible_cards.get(note_id)
+            if card is not None:
+                card.autosave()
+        
+    def update_note(self, note, values):
+        """修改便签字段：更新索引并写入存储，返回修改前的值"""
+        old = self.notebook.update(note, values)
+        if old.get("category", note.category) != note.category:
+            self.update_count()
+        self.store.put(note)
+        return old
+        
+    def place_note(self, note, index, pinned):
+        """移动便签并设置置顶标记：列表和分类索引只改这一条，卡片只移动位置、不重新绑定"""
+        if note.pinned != pinned:
+            note.pinned = pinned
+            note.rev += 1
+            self.store.put(note)
+        old_index = self.notebook.move(note, index)
+        index = self.notes.index(note)
+        if index != old_index:
+            self.store.move(note.id, *self.notebook.neighbours(index))
+        card = self.visible_cards.get(note.id)
+        if card is not None:
+            card.update_preview()
+        if self.view is self.notes:
+            self.render_visible()
+        else:
+            self.apply_search()  # 筛选结果按新顺序重新生成
+        return old_index, index
+        
+    def toggle_pin(self, note):
+        """置顶移到最前；取消置顶移到其余置顶便签之后"""
+        if self.loading:
+            return
+        self.collapse_other_cards(None)
+        pinned = not note.pinned
+        target = 0 if pinned else self.notebook.pinned_count() - 1
+        old_index, index = self.place_note(note, target, pinned)
+        self.history.record(("move", note.id, old_index, index, not pinned, pinned))
+        self.show_status(f"📌 已置顶: {note.title}" if pinned else f"已取消置顶: {note.title}")
+        
+    def start_drag(self, card, event):
+        if self.loading or card.note_data is None:
+            return
+        if self.view is not self.notes:
+            self.show_status("清除搜索和分类筛选后才能拖动排序")
+            return
+        self.collapse_other_cards(None)  # 展开的卡片高度不同，先收起再计算位置
+        index = self.notes.index(card.note_data)
+        self.drag = (card, index, event.y_root, self.row_top(index))
+        card.lift()
+        
+    def drag_motion(self, event):
+        """拖动时只移动这张卡片自身的位置"""
+        if self.drag is None:
+            return
+        card, index, start_y, top = self.drag
+        self.canvas.coords(card.canvas_item, 0, top + event.y_root - start_y)
+        
+    def end_drag(self, event):
+        if self.drag is None:
+            return
+        card, index, start_y, top = self.drag
+        self.drag = None
+        note = card.note_data
+        if note is None or self.view is not self.notes:
+            self.render_visible()
+            return
+        y = top + event.y_root - start_y + self.row_height / 2
+        target = max(0, min(self.row_at(y), len(self.notes) - 1))
+        # 置顶和未置顶的便签各自排序，不能互相越过
+        pinned_count = self.notebook.pinned_count()
+        if note.pinned:
+            target = min(target, pinned_count - 1)
+        else:
+            target = max(target, pinned_count)
+        if target == index:
+            self.render_visible()  # 放回原位
+            return
+        old_index, index = self.place_note(note, target, note.pinned)
+        self.history.record(("move", note.id, old_index, index, note.pinned, note.pinned))
+        
+    def undo(self):
+        self.replay(self.history.undo_stack, self.history.redo_stack, undo=True)
+        
+    def redo(self):
+        self.replay(self.history.redo_stack, self.history.undo_stack, undo=False)
+        
+    def replay(self, source, target, undo):
+        """撤销或重做一条操作记录，并把它移到另一个栈"""
+        if self.loading:
+            return
+        self.hide_toast()
+        self.collapse_other_cards(None)  # 先保存正在编辑的内容，它会成为最近的一条记录
+        action = "撤销" if undo else "重做"
+        if not source:
+            self.show_status(f"没有可{action}的操作")
+            return
+        op = source.pop()
+        kind = op[0]
+        if kind == "edit":
+            note_id, old, new = op[1:]
+            note = self.notes_by_id.get(note_id)
+            if note is None:
+                self.show_status(f"该便签已被删除，无法{action}修改")
+                return
+            self.update_note(note, old if undo else new)
+            card = self.visible_cards.get(note_id)
+            if card is not None:
+                card.update_preview()
+            self.show_status(f"已{action}修改: {note.title}")
+        elif kind == "move":
+            note_id, old_index, new_index, old_pinned, new_pinned = op[1:]
+            note = self.notes_by_id.get(note_id)
+            if note is None:
+                self.show_status(f"该便签已被删除，无法{action}移动")
+                return
+            self.place_note(note, old_index if undo else new_index, old_pinned if undo else new_pinned)
+            self.show_status(f"已{action}移动: {note.title}")
+        else:
+            entries = op[1]
+            ids = {note.id for index, note in entries}
+            if (kind == "delete") == undo:
+                # 撤销删除 / 重做新建：放回原位置
+                entries = [(index, note) for index, note in entries if note.id not in self.notes_by_id]
+                self.restore_notes(entries)
+                for index, note in entries:
+                    self.store.put(note, index=index)
+                if kind == "delete":
+                    try:
+                        self.trash.remove(ids)
+                    except OSError:
+                        pass
+            else:
+                # 撤销新建 / 重做删除
+                self.remove_notes(list(ids))
+                for note_id in ids:
+                    self.store.delete(note_id)
+                if kind == "delete":
+                    self.trash_notes([note for index, note in entries])
+            name = entries[0][1].title if len(entries) == 1 else f"{len(entries)} 条便签"
+            self.show_status(f"已{action}{'删除' if kind == 'delete' else '新建'}: {name}")
+        target.append(op)
+        
+    def on_undo_key(self, redo=False):
+        # 焦点在输入框里时留给输入框自己处理
+        if isinstance(self.root.focus_get(), (tk.Entry, tk.Text)):
+            return None
+        if redo:
+            self.redo()
+        else:
+            self.undo()
+        return "break"
+        
+    def on_delete_key(self):
+        if isinstance(self.root.focus_get(), (tk.Entry, tk.Text)):
+            return None
+        self.delete_selected()
+        return "break"
+        
+    def show_toast(self, message, action_text, action):
+        """画布底部的非模态提示条，几秒后自动消失"""
+        self.toast_label.config(text=message)
+        self.toast_action.config(text=action_text)
+        self.toast_callback = action
+        self.toast.place(relx=0.5, rely=1.0, anchor=tk.S, y=-12)
+        self.toast.lift()
+        if self.toast_job is not None:
+            self.root.after_cancel(self.toast_job)
+        self.toast_job = self.root.after(6000, self.hide_toast)
+        
+    def hide_toast(self):
+        if self.toast_job is not None:
+            self.root.after_cancel(self.toast_job)
+            self.toast_job = None
+        self.toast.place_forget()
+        
+    def on_toast_click(self):
+        callback = self.toast_callback
+        self.hide_toast()
+        if callback is not None:
+            callback()
+            
+    def show_trash_menu(self, menu):
+        """回收站子菜单：最近删除的便签，点击恢复到列表开头"""
+        menu.delete(0, tk.END)
+        try:
+            entries = self.trash.read()
+        except OSError:
+            entries = []
+        for deleted_at, note in entries[:20]:
+            when = datetime.fromtimestamp(deleted_at).strftime("%m-%d %H:%M")
+            title = note.title if len(note.title) <= 20 else note.title[:20] + "..."
+            menu.add_command(label=f"{when}  {title}", command=lambda n=note: self.restore_from_trash(n))
+        if not entries:
+            menu.add_command(label="（回收站是空的）", state=tk.DISABLED)
+        else:
+            if len(entries) > 20:
+                menu.add_command(label=f"…共 {len(entries)} 条", state=tk.DISABLED)
+            menu.add_separator()
+            menu.add_command(label="清空回收站", command=self.empty_trash)
+            
+    def restore_from_trash(self, note):
+        if self.loading:
+            return
+        try:
+            self.trash.remove({note.id})
+        except OSError as e:
+            messagebox.showerror("回收站", f"恢复失败: {str(e)}")
+            return
+        if note.id not in self.notes_by_id:
+            index = self.notebook.pinned_count()
+            self.restore_notes([(index, note)])
+            self.store.put(note, index=index)
+            self.canvas.yview_moveto(0)
+        self.show_status(f"♻️ 已恢复: {note.title}")
+        
+    def empty_trash(self):
+        if messagebox.askyesno("清空回收站", "确定要永久删除回收站中的所有便签吗?"):
+            try:
+                self.trash.clear()
+            except OSError as e:
+                messagebox.showerror("回收站", f"清空失败: {str(e)}")
+        
+    def move_category(self, note, old_category):
+        if self.notebook.move_category(note, old_category):
+            self.update_count()
+        
+    def set_category_filter(self, category):
+        """切换分类：只替换显示的便签列表，可见卡片重新绑定"""
+        if self.loading:
+            return
+        if category != self.category_filter:
+            self.category_filter = category
+            self.apply_search()
+        
+    def view_index(self, note):
+        try:
+            return self.view.index(note)
+        except ValueError:
+            return None
+            
+    def apply_search(self):
+        """按搜索框内容切换显示的便签，只重新绑定可见卡片"""
+        self.view = self.notebook.search(self.search_var.get(), self.category_filter)
+        self.canvas.yview_moveto(0)
+        self.refresh_cards()
+            
+    def collapse_other_cards(self, current_id):
+        for note_id, card in list(self.visible_cards.items()):
+            if note_id != current_id and card.is_expanded:
+                card.collapse_card()
+                
+    def insert_card(self, index, count=1):
+        """增量更新：在 index 处插入了 count 条便签，只为其中可见的绑定卡片"""
+        if self.expanded_index is not None and index <= self.expanded_index:
+            self.expanded_index += count
+        self.update_count()
+        self.update_layout()
+        
+    def remove_card(self, note_id, index):
+        """增量更新：删除了 index 处的便签，只回收它对应的卡片"""
+        card = self.visible_cards.pop(note_id, None)
+        if card is not None:
+            card.unbind_note()
+            self.free_cards.append(card)
+        if self.expanded_index is not None and index < self.expanded_index:
+            self.expanded_index -= 1
+        self.update_count()
+        self.update_layout()
+        
+    def update_count(self):
+        if not hasattr(self, 'count_label'):
+            return
+        if self.view is self.notes:
             self.count_label.config(text=f"共 {len(self.notes)} 条")
-        
-        if not self.notes:
-            tk.Label(
-                self.scrollable_frame,
-                text="📝 点击\"新建\"开始使用",
-                font=("Microsoft YaHei", 12),
-                fg="#bdc3c7",
-                bg="#ecf0f1"
-            ).pack(pady=100)
+        else:
+            self.count_label.config(text=f"找到 {len(self.view)} / {len(self.notes)} 条")
+        self.update_chips()
+        
+    def update_chips(self):
+        """刷新分类标签上的数量和选中状态（数量直接取分类 id 列表长度）"""
+        for category, chip in self.category_chips.items():
+            if category is None:
+                name, count, color = "全部", len(self.notes), "#34495e"
+            else:
+                name, count = category, len(self.category_ids.get(category, ()))
+                color = NoteCard.category_colors[category]
+            if category == self.category_filter:
+                chip.config(text=f"{name} {count}", fg="white", bg=color)
+            else:
+                chip.config(text=f"{name} {count}", fg=color, bg="#f8f9fa")
+                
+    def refresh_cards(self):
+        # 数据整体变化：回收所有卡片，再按当前滚动位置重新绑定可见部分
+        for card in self.visible_cards.values():
+            if card.is_expanded:
+                card.save_card(show_message=False)
+                card.close_editor()
+            self.free_cards.append(card)
+        self.visible_cards.clear()
+        self.expanded_id = None
+        self.expanded_index = None
+        
+        self.update_count()
+        self.update_layout()
+        
+    def create_card(self):
+        card = NoteCard(self.canvas, self)
+        card.canvas_item = self.canvas.create_window(
+            0, 0,
+            window=card,
+            anchor=tk.NW,
+            width=self.canvas.winfo_width(),
+            state=tk.HIDDEN
+        )
+        self.cards.append(card)
+        return card
+        
+    def measure_row_height(self):
+        """用一个绑定了便签的卡片测量折叠卡片高度"""
+        note = self.view[0]
+        card = self.visible_cards.get(note.id)
+        if card is None:
+            card = self.free_cards.pop() if self.free_cards else self.create_card()
+            card.bind_note(note)
+            self.visible_cards[note.id] = card
+        elif card.is_expanded:
+            # 第一条正在编辑（例如新建后调整了窗口大小）：另用池中折叠的卡片测量，测完放回池中
+            card = self.free_cards.pop() if self.free_cards else self.create_card()
+            card.bind_note(note)
+            self.free_cards.append(card)
+        card.update_idletasks()
+        self.row_height = card.winfo_reqheight()
+        
+    def row_top(self, index):
+        """计算第 index 张卡片的顶部坐标"""
+        top = index * (self.row_height + self.card_gap)
+        if self.expanded_index is not None and index > self.expanded_index:
+            top += self.expanded_height - self.row_height
+        return top
+        
+    def row_at(self, y):
+        """计算纵坐标 y 处的卡片位置"""
+        pitch = self.row_height + self.card_gap
+        if self.expanded_index is not None:
+            expanded_top = self.row_top(self.expanded_index)
+            if y >= expanded_top:
+                after_expanded = expanded_top + self.expanded_height + self.card_gap
+                if y < after_expanded:
+                    return self.expanded_index
+                return self.expanded_index + 1 + int((y - after_expanded) // pitch)
+        return max(0, int(y // pitch))
+        
+    def update_layout(self):
+        """卡片展开/折叠或数据变化后重新计算布局"""
+        if self.view and self.row_height is None:
+            self.measure_row_height()
+        expanded = [card for card in self.visible_cards.values() if card.is_expanded]
+        if expanded:
+            card = expanded[0]
+            if card.note_id != self.expanded_id:
+                self.expanded_index = self.view.index(card.note_data)
+                self.expanded_id = card.note_id
+            card.update_idletasks()
+            self.expanded_height = card.winfo_reqheight()
+        else:
+            self.expanded_id = None
+            self.expanded_index = None
+        self.update_scrollregion()
+        self.render_visible()
+        
+    def update_scrollregion(self):
+        if self.view and self.row_height is not None:
+            height = self.row_top(len(self.view))
+        else:
+            height = 0
+        self.canvas.configure(scrollregion=(0, 0, self.canvas.winfo_width(), height))
+        
+    def render_visible(self):
+        """只为可见区域（含上下缓冲）绑定卡片，滚出区域的卡片回收复用"""
+        if not self.view:
+            for card in self.cards:
+                self.canvas.itemconfig(card.canvas_item, state=tk.HIDDEN)
+            if self.loading:
+                hint = "⚠ 加载失败" if self.notebook.load_error is not None else "⏳ 正在加载..."
+            elif not self.notes:
+                hint = "📝 点击\"新建\"开始使用"
+            else:
+                hint = "没有找到匹配的便签"
+            self.canvas.itemconfig(self.empty_hint, text=hint, state=tk.NORMAL)
+            return
+        self.canvas.itemconfig(self.empty_hint, state=tk.HIDDEN)
+        if self.row_height is None:
+            return
+        
+        top = self.canvas.canvasy(0)
+        bottom = top + self.canvas.winfo_height()
+        first = max(0, self.row_at(top) - self.overscan)
+        last = min(len(self.view) - 1, self.row_at(bottom) + self.overscan)
+        wanted = {self.view[index].id: index for index in range(first, last + 1)}
+        if self.expanded_id is not None:
+            wanted[self.expanded_id] = self.expanded_index  # 正在编辑的卡片不回收
+        
+        # 按便签 id 对比：仍可见的卡片保持绑定，只移动位置
+        for note_id in list(self.visible_cards):
+            if note_id not in wanted:
+                self.free_cards.append(self.visible_cards.pop(note_id))
+        
+        for note_id, index in wanted.items():
+            card = self.visible_cards.get(note_id)
+            if card is None:
+                card = self.free_cards.pop() if self.free_cards else self.create_card()
+                card.bind_note(self.view[index])
+                self.visible_cards[note_id] = card
+            height = self.expanded_height if index == self.expanded_index else self.row_height
+            self.canvas.coords(card.canvas_item, 0, self.row_top(index))
+            self.canvas.itemconfig(card.canvas_item, height=height, state=tk.NORMAL)
+        
+        for card in self.free_cards:
+            self.canvas.itemconfig(card.canvas_item, state=tk.HIDDEN)
+            
+    def copy_text(self, text):
+        """复制到剪贴板并记入历史"""
+        self.root.clipboard_clear()
+        self.root.clipboard_append(text)
+        if text in self.clipboard_history:
+            self.clipboard_history.remove(text)
+        self.clipboard_history.appendleft(text)
+        
+    def render_note(self, note):
+        """复制用的文本：正在编辑的先写入编辑框中的内容，模板便签展开占位符；模板有错误时抛出 TemplateError"""
+        card = self.visible_cards.get(note.id)
+        if card is not None and card.is_expanded:
+            card.autosave()
+        text, counted = self.notebook.templates.render(note, self.clipboard_text)
+        for owner in counted:
+            self.store.put(owner)  # 计数随便签保存
+        return text
+        
+    def clipboard_text(self):
+        try:
+            return self.root.clipboard_get()
+        except tk.TclError:
+            return ""
+            
+    def copy_note(self, note):
+        """直接从便签数据复制，不创建编辑组件；没有复制时返回原因（命令服务回复用）"""
+        try:
+            content = self.render_note(note)
+        except TemplateError as e:
+            self.show_status(f"⚠ {e}")
+            return str(e)
+        if not content:
+            self.show_status("内容为空")
+            return "内容为空"
+        self.copy_text(content)
+        self.show_status(f"✓ 已复制: {note.title or '未命名'}")
+        return None
             
+    def copy_nth(self, number):
+        """Ctrl+1..9：复制当前列表中的第 n 条便签"""
+        if number <= len(self.view):
+            self.copy_note(self.view[number - 1])
+            
+    def show_clipboard_history(self, anchor):
+        if not self.clipboard_history:
+            self.show_status("还没有复制记录")
+            return
+        menu = tk.Menu(self.root, tearoff=0)
+        for text in self.clipboard_history:
+            label = " ".join(text.split())
+            label = label[:30] + "..." if len(label) > 30 else label
+            menu.add_command(label=label, command=lambda t=text: self.recopy(t))
+        menu.tk_popup(anchor.winfo_rootx(), anchor.winfo_rooty() + anchor.winfo_height())
+        
+    def recopy(self, text):
+        self.copy_text(text)
+        self.show_status("✓ 已从历史复制")
+        
+    def toggle_selection(self, note_id):
+        if note_id in self.selected_ids:
+            self.selected_ids.remove(note_id)
+        else:
+            self.selected_ids.append(note_id)
+        card = self.visible_cards.get(note_id)
+        if card is not None:
+            card.update_highlight()
+        self.update_queue_button()
+        
+    def clear_selection(self):
+        selected, self.selected_ids = self.selected_ids, []
+        for note_id in selected:
+            card = self.visible_cards.get(note_id)
+            if card is not None:
+                card.update_highlight()
+                
+    def on_queue_click(self):
+        """复制队列：有队列时复制下一项，否则用选中的卡片建立队列"""
+        if self.copy_queue:
+            self.copy_queue_position += 1
+            self.copy_queue_item()
+        elif self.selected_ids:
+            self.copy_queue = list(self.selected_ids)
+            self.copy_queue_position = 0
+            self.clear_selection()
+            self.copy_queue_item()
+        else:
+            self.show_status("Ctrl+单击卡片选择要依次复制的便签，再点击队列")
+            
+    def copy_queue_item(self):
+        # 跳过已被删除的便签
+        while (self.copy_queue_position < len(self.copy_queue)
+               and self.copy_queue[self.copy_queue_position] not in self.notes_by_id):
+            self.copy_queue_position += 1
+        if self.copy_queue_position >= len(self.copy_queue):
+            self.clear_copy_queue()
+            self.show_status("✓ 复制队列已完成")
+            return
+        note = self.notes_by_id[self.copy_queue[self.copy_queue_position]]
+        try:
+            content = self.render_note(note)
+        except TemplateError as e:
+            self.show_status(f"⚠ {e}")
+            return
+        self.copy_text(content)
+        self.show_status(
+            f"✓ 已复制 {self.copy_queue_position + 1}/{len(self.copy_queue)}: {note.title or '未命名'}"
+            "（F2 下一项）")
+        self.update_queue_button()
+        
+    def clear_copy_queue(self):
+        self.copy_queue = []
+        self.copy_queue_position = 0
+        self.update_queue_button()
+        
+    def update_queue_button(self):
+        if self.copy_queue:
+            text = f"⏭ 已复制 {self.copy_queue_position + 1}/{len(self.copy_queue)}"
+        elif self.selected_ids:
+            text = f"⏭ 队列 ({len(self.selected_ids)})"
+        else:
+            text = "⏭ 队列"
+        self.queue_btn.config(text=text)
+        
     def show_status(self, message):
         self.status_label.config(text=message, fg="#27ae60")
         self.root.after(3000, lambda: self.status_label.config(text="就绪", fg="#7f8c8d"))
         
-    def load_data(self):
+    def load_data(self, notebook):
+        """在后台线程读取笔记本数据，界面线程轮询结果"""
+        result = queue.Queue()
+        
+        def worker():
+            try:
+                result.put((notebook.store.read(), None))
+            except Exception as e:
+                result.put((([], None), e))
+            try:
+                notebook.trash.purge()
+            except OSError:
+                pass
+        
+        threading.Thread(target=worker, name="LoadData", daemon=True).start()
+        self.poll_loaded(notebook, result)
+        
+    def poll_loaded(self, notebook, result):
         try:
-            if os.path.exists(self.data_file):
-                with open(self.data_file, 'r', encoding='utf-8') as f:
-                    self.notes = json.load(f)
-        except Exception as e:
-            messagebox.showerror("加载错误", f"加载数据失败: {str(e)}")
-            self.notes = []
+            (notes, signature), error = result.get_nowait()
+        except queue.Empty:
+            self.root.after(20, self.poll_loaded, notebook, result)
+            return
+        if error is not None:
+            # 不能装入空列表：之后的保存或整理会用空数据覆盖原文件
+            notebook.load_error = error
+            if notebook is self.notebook:
+                self.render_visible()
+                self.count_label.config(text="加载失败")
+            if messagebox.askretrycancel(
+                    "加载错误", f"加载数据失败: {str(error)}\n\n数据文件没有被修改，是否重试？"):
+                notebook.load_error = None
+                self.load_data(notebook)
+            elif notebook is self.notebook:
+                self.show_status("⚠ 笔记本未加载，不能编辑；切换到其他笔记本再切换回来可重新读取")
+            return
+        notebook.install(notes)
+        notebook.store.seen = signature
+        if notebook is self.notebook:
+            # 先显示第一屏卡片，再分批建立搜索索引
+            self.view = self.notes
+            if self.category_filter is not None or self.search_var.get().strip():
+                self.apply_search()
+            else:
+                self.refresh_cards()
+            self.report_startup("显示卡片")
+        self.index_next_chunk(notebook)
+        
+    def index_next_chunk(self, notebook):
+        """每次最多占用约 30ms 建立索引，之间让出界面线程处理输入"""
+        if self.loaded_notebooks.get(notebook.name) is not notebook:
+            return  # 已被关闭
+        if not notebook.index_some(time.perf_counter() + 0.03):
+            if notebook is self.notebook:
+                self.count_label.config(
+                    text=f"加载中 {notebook.index_position} / {len(notebook.index_queue)}")
+            self.root.after(1, self.index_next_chunk, notebook)
+            return
+        if notebook is self.notebook:
+            self.update_count()
+            if self.search_var.get().strip():
+                self.apply_search()
+            self.report_startup("全部加载完成")
+            
+    def open_notebook(self, name):
+        """取已在内存中的笔记本，否则创建并在后台读取；最近使用的排到最后"""
+        notebook = self.loaded_notebooks.get(name)
+        if notebook is not None and notebook.load_error is not None:
+            notebook.load_error = None
+            self.load_data(notebook)  # 上次读取失败，重新读取
+        if notebook is None:
+            entry = self.manifest.get(name)
+            notebook = Notebook(name, entry["file"], self.store_class)
+            self.loaded_notebooks[name] = notebook
+            if self.notebook is not None:
+                self.load_data(notebook)
+        self.loaded_notebooks.move_to_end(name)
+        return notebook
+        
+    def close_notebook(self, notebook):
+        """同步写入剩余数据，并在清单中记下便签数量"""
+        store = notebook.store
+        store.flush()
+        if store.write_deferred and not notebook.loading:
+            # 其他实例改过文件：先合并再写，避免覆盖对方的修改
+            notes, signature = store.read()
+            if notebook is self.notebook:
+                self.merge_external(notes)
+            else:
+                notebook.apply_merge(notebook.merge_plan(notes))
+            self.finish_merge(notebook, signature)
+        store.close()
+        self.report_save_errors([notebook.store])
+        if not notebook.loading:
+            self.manifest.get(notebook.name)["count"] = len(notebook.notes)
             
-    def save_data(self):
+    def evict_notebooks(self):
+        """内存中的笔记本超过上限时，关闭最久未用的（当前和正在读取的除外）"""
+        for name, notebook in list(self.loaded_notebooks.items()):
+            if len(self.loaded_notebooks) <= self.max_loaded_notebooks:
+                break
+            if notebook is self.notebook or notebook.loading:
+                continue
+            self.close_notebook(notebook)
+            del self.loaded_notebooks[name]
+            
+    def switch_notebook(self, name):
+        """切换笔记本：最近用过的直接从内存取，否则后台读取"""
+        if name == self.notebook.name:
+            return
+        # 正在编辑的卡片必须在切换前保存到它所属的笔记本
+        for card in self.visible_cards.values():
+            if card.is_expanded:
+                card.save_card(show_message=False)
+                card.close_editor()
+        self.clear_selection()
+        self.clear_copy_queue()
+        self.hide_toast()
+        
+        self.notebook = self.open_notebook(name)
+        self.manifest.active = name
+        self.evict_notebooks()
+        self.save_manifest()
+        self.notebook_btn.config(text=f"📒 {name} ▾")
+        
+        if self.loading:
+            self.view = self.notes
+            self.canvas.yview_moveto(0)
+            self.refresh_cards()
+            self.count_label.config(text="加载中...")
+        else:
+            self.apply_search()
+        self.show_status(f"📒 已切换到: {name}")
+        
+    def show_notebook_menu(self):
+        """列出清单中的笔记本；已在内存中的显示实时数量"""
+        menu = tk.Menu(self.root, tearoff=0)
+        for entry in self.manifest.notebooks:
+            name = entry["name"]
+            notebook = self.loaded_notebooks.get(name)
+            count = entry.get("count") if notebook is None or notebook.loading else len(notebook.notes)
+            mark = "✓ " if name == self.notebook.name else "    "
+            label = f"{mark}{name}" if count is None else f"{mark}{name}  ({count})"
+            menu.add_command(label=label, command=lambda n=name: self.switch_notebook(n))
+        menu.add_separator()
+        menu.add_command(label="➕ 新建笔记本...", command=self.new_notebook)
+        menu.tk_popup(self.notebook_btn.winfo_rootx(),
+                      self.notebook_btn.winfo_rooty() + self.notebook_btn.winfo_height())
+        
+    def new_notebook(self):
+        name = simpledialog.askstring("新建笔记本", "笔记本名称:", parent=self.root)
+        if name is None:
+            return
+        name = name.strip()
+        if not name:
+            return
+        if self.manifest.get(name) is not None:
+            messagebox.showwarning("新建笔记本", f"笔记本 '{name}' 已存在")
+            return
+        self.manifest.add(name)
+        self.switch_notebook(name)
+        
+    def save_manifest(self):
         try:
-            with open(self.data_file, 'w', encoding='utf-8') as f:
-                json.dump(self.notes, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            messagebox.showerror("保存错误", f"保存数据失败: {str(e)}")
+            self.manifest.save()
+        except OSError as e:
+            messagebox.showerror("保存错误", f"保存笔记本清单失败: {str(e)}")
+        
+    def watch_files(self):
+        """每秒检查当前笔记本的数据文件是否被其他实例修改（只比较修改时间和大小）"""
+        notebook = self.notebook
+        if not notebook.loading and not self.reloading and notebook.store.external_changed(wait=False):
+            self.reloading = True
+            result = queue.Queue()
             
-    def load_window_config(self):
+            def worker():
+                try:
+                    result.put((notebook.store.read(), None))
+                except Exception as e:
+                    result.put(((None, None), e))
+            
+            threading.Thread(target=worker, name="ReloadData", daemon=True).start()
+            self.poll_reloaded(notebook, result)
+        self.root.after(1000, self.watch_files)
+        
+    def poll_reloaded(self, notebook, result):
         try:
-            if os.path.exists(self.config_file):
-                with open(self.config_file, 'r', encoding='utf-8') as f:
-                    config = json.load(f)
-                    self.root.geometry(config.get('geometry', '480x650'))
-                    self.alpha_var = tk.DoubleVar(value=config.get('alpha', 0.95))
-                    return
-        except:
-            pass
-        self.root.geometry("480x650")
+            (notes, signature), error = result.get_nowait()
+        except queue.Empty:
+            self.root.after(20, self.poll_reloaded, notebook, result)
+            return
+        self.reloading = False
+        if error is not None:
+            self.show_status(f"⚠ 读取外部修改失败: {error}")
+            return
+        if notebook is not self.notebook:
+            return  # 已切换到其他笔记本，切换回来时会重新检查
+        self.merge_external(notes)
+        self.finish_merge(notebook, signature)
+        
+    def finish_merge(self, notebook, signature):
+        store = notebook.store
+        store.seen = signature
+        if store.write_deferred or store.needs_compact:
+            # 推迟的整体重写现在包含了双方的修改
+            store.write_deferred = False
+            store.needs_compact = False
+            store.compact()
+            
+    def merge_external(self, disk_notes):
+        """合并其他实例写入的修改，只更新受影响的卡片，不整体刷新"""
+        added, updated, removed, disk_ids = self.notebook.merge_plan(disk_notes)
+        conflicts = 0
+        for local, note in updated:
+            conflicts += self.replace_note(local, note)
+        for note_id in removed:
+            self.forget_note(note_id)
+        if added:
+            # 新增的便签一次插入（命令行导入可能有数千条），各索引只更新一次，搜索索引分批建立
+            index = self.notebook.pinned_count()
+            pinned = sum(1 for note in added if note.pinned)  # 插到最前，其余插到置顶便签之后
+            if self.notebook.prepend(added):
+                self.index_next_chunk(self.notebook)
+            if self.view is self.notes:
+                if pinned:
+                    self.insert_card(0, pinned)
+                if len(added) > pinned:
+                    self.insert_card(index + pinned, len(added) - pinned)
+        self.known_ids = disk_ids
+        if added or updated or removed:
+            self.update_count()
+            message = f"🔄 已同步其他窗口的修改：新增 {len(added)}，更新 {len(updated)}，删除 {len(removed)}"
+            if conflicts:
+                message += "（正在编辑的便签保存后以本窗口为准）"
+            self.show_status(message)
+            
+    def replace_note(self, local, note):
+        """用外部修改替换内存中的便签（原地更新，卡片绑定的仍是同一对象）；该便签正在编辑时返回 True"""
+        old_category = local.category
+        old = {"title": local.title, "content": local.content, "category": old_category}
+        # 其他实例置顶或取消置顶：与 toggle_pin 相同，移到置顶便签的开头或末尾
+        target = None
+        if note.pinned != local.pinned:
+            target = 0 if note.pinned else self.notebook.pinned_count() - 1
+        local.update_from(note)
+        self.search_index.update(local, old)
+        self.preview_cache.pop(local.id, None)
+        self.move_category(local, old_category)
+        if target is not None:
+            self.notebook.move(local, target)
+            if self.view is self.notes:
+                self.expanded_id = None  # 展开的卡片位置可能变了，重新查找
+                self.update_layout()
+            else:
+                self.apply_search()
+        card = self.visible_cards.get(local.id)
+        if card is not None and card.is_expanded:
+            return True
+        if card is not None:
+            card.update_preview()
+        return False
+        
+    def show_file_menu(self, anchor):
+        menu = tk.Menu(self.root, tearoff=0)
+        menu.add_command(label="📥 导入 CSV / JSON Lines...", command=self.import_file)
+        menu.add_command(label="📤 导出当前笔记本...", command=self.export_file)
+        menu.add_separator()
+        trash_menu = tk.Menu(menu, tearoff=0, postcommand=lambda: self.show_trash_menu(trash_menu))
+        menu.add_cascade(label="🗑️ 回收站", menu=trash_menu)
+        menu.tk_popup(anchor.winfo_rootx(), anchor.winfo_rooty() + anchor.winfo_height())
+        
+    def run_with_progress(self, title, work, done):
+        """在后台线程执行 work(report, cancelled)，显示进度条和取消按钮；完成后在界面线程调用 done(result)
+        
+        work 中调用 report(比例, 说明) 更新进度，并应定期检查 cancelled.is_set()。
+        """
+        dialog = tk.Toplevel(self.root)
+        dialog.title(title)
+        dialog.attributes("-topmost", True)
+        dialog.resizable(False, False)
+        dialog.transient(self.root)
+        
+        message = tk.Label(dialog, text="准备中...", font=("Microsoft YaHei", 9), anchor=tk.W)
+        message.pack(fill=tk.X, padx=15, pady=(12, 6))
+        bar = ttk.Progressbar(dialog, length=300, maximum=1.0)
+        bar.pack(padx=15)
+        
+        cancelled = threading.Event()
+        ttk.Button(dialog, text="取消", command=cancelled.set).pack(pady=10)
+        dialog.protocol("WM_DELETE_WINDOW", cancelled.set)
+        
+        progress = queue.Queue()
+        
+        def report(fraction, text):
+            progress.put(("progress", (fraction, text)))
+        
+        def worker():
+            try:
+                progress.put(("done", (work(report, cancelled), None)))
+            except Exception as e:
+                progress.put(("done", (None, e)))
+        
+        def poll():
+            latest = None
+            try:
+                while True:
+                    kind, value = progress.get_nowait()
+                    if kind == "done":
+                        dialog.destroy()
+                        result, error = value
+                        if error is not None:
+                            messagebox.showerror(title, f"{title}失败: {str(error)}")
+                        elif cancelled.is_set():
+                            self.show_status(f"已取消{title}")
+                        else:
+                            done(result)
+                        return
+                    latest = value
+            except queue.Empty:
+                pass
+            if latest is not None:
+                bar["value"] = latest[0]
+                message.config(text=latest[1])
+            self.root.after(50, poll)
+        
+        threading.Thread(target=worker, name=title, daemon=True).start()
+        poll()
+        
+    def import_file(self):
+        """流式解析文件，全部读完后一次性插入；取消则不导入任何便签"""
+        if self.loading:
+            self.show_status("正在加载数据，请稍候...")
+            return
+        path = filedialog.askopenfilename(
+            parent=self.root,
+            title="导入便签",
+            filetypes=[("CSV / JSON Lines", "*.csv *.jsonl *.ndjson *.json"), ("所有文件", "*.*")]
+        )
+        if not path:
+            return
+        total = max(1, os.path.getsize(path))
+        
+        def work(report, cancelled):
+            notes = []
+            for position, note in iter_import_file(path):
+                if cancelled.is_set():
+                    return None
+                notes.append(note)
+                if len(notes) % 500 == 0:
+                    report(position / total, f"已读取 {len(notes)} 条...")
+            return notes
+        
+        notebook = self.notebook
+        self.run_with_progress("导入", work, lambda notes: self.import_notes(notebook, notes))
+        
+    def import_notes(self, notebook, notes):
+        """批量插入到列表开头：各索引一次更新，存储整体写入一次，卡片列表只刷新一次"""
+        if notebook is not self.notebook:
+            self.show_status("导入期间切换了笔记本，已取消导入")
+            return
+        if not notes:
+            self.show_status("文件中没有便签")
+            return
+        # 搜索索引沿用启动时的分批建立，期间搜索会逐条比对未索引的部分
+        if notebook.prepend(notes):
+            self.index_next_chunk(notebook)
+        
+        self.store.compact()
+        self.apply_search()
+        self.show_status(f"📥 已导入 {len(notes)} 条便签")
+        
+    def export_file(self):
+        """从存储逐页读取并逐条写出，不在内存中拼出整个文件"""
+        if self.loading:
+            self.show_status("正在加载数据，请稍候...")
+            return
+        path = filedialog.asksaveasfilename(
+            parent=self.root,
+            title="导出便签",
+            initialfile=f"{self.notebook.name}.csv",
+            defaultextension=".csv",
+            filetypes=[("CSV", "*.csv"), ("JSON Lines", "*.jsonl")]
+        )
+        if not path:
+            return
+        store = self.store
+        store.flush()
+        total = max(1, len(self.notes))
+        
+        def work(report, cancelled):
+            def notes():
+                for i, note in enumerate(store.iterate()):
+                    if cancelled.is_set():
+                        return
+                    if i % 500 == 0:
+                        report(i / total, f"已导出 {i} 条...")
+                    yield note
+            count = write_export_file(path, notes())
+            if cancelled.is_set():
+                os.remove(path)  # 不留下写了一半的文件
+            return count
+        
+        def done(count):
+            self.show_status(f"📤 已导出 {count} 条便签: {os.path.basename(path)}")
+        
+        self.run_with_progress("导出", work, done)
+        
+    def report_startup(self, stage):
+        """启动计时模式（--timing）下输出各阶段耗时"""
+        if self.timing:
+            elapsed = time.perf_counter() - STARTED_AT
+            print(f"[startup] {stage}: {elapsed * 1000:.1f} ms", flush=True)
+        
+    def report_save_errors(self, stores=None):
+        """在界面线程中提示后台保存失败（默认检查所有已打开的笔记本）"""
+        if stores is None:
+            stores = [notebook.store for notebook in self.loaded_notebooks.values()]
+        for store in stores:
+            try:
+                while True:
+                    e = store.errors.get_nowait()
+                    messagebox.showerror("保存错误", f"保存数据失败: {str(e)}")
+            except queue.Empty:
+                pass
+            
+    def poll_save_errors(self):
+        self.report_save_errors()
+        self.root.after(1000, self.poll_save_errors)
+            
+    def load_window_config(self):
+        self.root.geometry(self.config.get('geometry', '480x650'))
+        if 'alpha' in self.config:
+            self.alpha_var = tk.DoubleVar(value=self.config['alpha'])
         
     def save_window_config(self):
         try:
-            config = {
+            config = dict(self.config)
+            config.update({
                 'geometry': self.root.geometry(),
                 'alpha': self.root.attributes("-alpha")
-            }
+            })
             with open(self.config_file, 'w', encoding='utf-8') as f:
                 json.dump(config, f, indent=2)
         except:
             pass
             
-    def on_closing(self):
-        for card in self.cards:
+    def enable_profiler(self):
+        """开启事件耗时统计：Ctrl+Shift+D 显示/隐藏调试面板，Ctrl+Shift+S 导出"""
+        self.profiler = Profiler()
+        self.profiler.instrument(NoteCard, ["expand_card", "collapse_card", "save_card"])
+        self.profiler.instrument(self, [
+            "new_note", "delete_note", "on_window_resize", "apply_resize",
+            "refresh_cards", "on_mouse_wheel", "render_visible", "apply_search",
+        ])
+        
+    def profile_context(self):
+        """与耗时一起记录的环境信息"""
+        return {
+            "notes": len(self.notes),
+            "visible_notes": len(self.view),
+            "card_pool": len(self.cards),
+            "widgets": self.count_widgets(self.root),
+        }
+        
+    def count_widgets(self, widget):
+        return 1 + sum(self.count_widgets(child) for child in widget.winfo_children())
+        
+    def toggle_profiler_panel(self):
+        panel = self.profiler_panel
+        if panel is not None and panel.winfo_exists():
+            if panel.state() == "withdrawn":
+                panel.deiconify()
+                self.refresh_profiler_panel()
+            else:
+                panel.withdraw()
+            return
+        
+        panel = self.profiler_panel = tk.Toplevel(self.root)
+        panel.title("性能调试")
+        panel.attributes("-topmost", True)
+        panel.protocol("WM_DELETE_WINDOW", panel.withdraw)
+        
+        self.profiler_text = tk.Text(panel, font=("Consolas", 9), width=60, height=20,
+                                     relief=tk.FLAT, bg="#f8f9fa")
+        self.profiler_text.pack(fill=tk.BOTH, expand=True, padx=8, pady=(8, 4))
+        
+        buttons = tk.Frame(panel)
+        buttons.pack(fill=tk.X, padx=8, pady=(0, 8))
+        ttk.Button(buttons, text="导出", command=self.dump_profile).pack(side=tk.RIGHT)
+        ttk.Button(buttons, text="重置", command=self.reset_profiler).pack(side=tk.RIGHT, padx=(0, 6))
+        self.refresh_profiler_panel()
+        
+    def refresh_profiler_panel(self):
+        panel = self.profiler_panel
+        if panel is None or not panel.winfo_exists() or panel.state() == "withdrawn":
+            return
+        self.profiler_text.delete("1.0", tk.END)
+        self.profiler_text.insert("1.0", self.profiler.report(self.profile_context()))
+        self.root.after(1000, self.refresh_profiler_panel)
+        
+    def reset_profiler(self):
+        self.profiler.stats.clear()
+        self.refresh_profiler_panel()
+        
+    def dump_profile(self):
+        path = f"sticky_notes_profile_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+        try:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(self.profiler.snapshot(self.profile_context()), f, ensure_ascii=False, indent=2)
+            self.show_status(f"✓ 已导出性能数据: {path}")
+        except Exception as e:
+            messagebox.showerror("导出错误", f"导出失败: {str(e)}")
+            
+    def start_server(self):
+        try:
+            self.server = CommandServer(self.serve_request)
+        except OSError as e:
+            self.show_status(f"⚠ 命令服务启动失败: {e}")
+            return
+        self.poll_commands()
+        
+    def serve_request(self, request):
+        """在命令服务线程中调用：查询直接读取内存中的数据，修改和界面操作交给界面线程"""
+        command = request.get("cmd")
+        if command == "ping":
+            return {"ok": True, "pid": os.getpid()}
+        if command in ("list", "search", "get"):
+            notebook = self.notebook
+            if notebook.loading or request.get("notebook") not in (None, notebook.name):
+                return {"ok": False, "error": "当前笔记本不可用", "fallback": True}
+            try:
+                return self.read_command(notebook, command, request)
+            except (RuntimeError, KeyError, IndexError):
+                # 界面线程正在修改列表或索引（集合大小变化、刚删除的便签查不到），改为交给界面线程执行
+                pass
+        elif command not in ("add", "copy", "focus"):
+            return {"ok": False, "error": f"未知命令: {command}"}
+        reply = queue.Queue()
+        self.command_queue.put((request, reply))
+        try:
+            return reply.get(timeout=5)
+        except queue.Empty:
+            # 界面被对话框等占用：查询可以改由命令行直接读取数据文件，新建和复制不能重复执行
+            return {"ok": False, "error": "界面无响应", "fallback": command in ("list", "search", "get")}
+            
+    def read_command(self, notebook, command, request):
+        if command == "get":
+            note = notebook.find(request.get("key", ""))
+            if note is None:
+                return {"ok": False, "error": "找不到便签（或匹配不唯一）"}
+            return {"ok": True, "note": note.to_dict()}
+        notes = notebook.search(request.get("query", "") if command == "search" else "",
+                                request.get("category"))
+        limit = request.get("limit")
+        if limit is not None:
+            notes = notes[:limit]
+        return {"ok": True, "notes": [note.to_dict() for note in notes]}
+        
+    def poll_commands(self):
+        while True:
+            try:
+                request, reply = self.command_queue.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                reply.put(self.run_command(request))
+            except Exception as e:
+                reply.put({"ok": False, "error": str(e)})
+        self.root.after(20, self.poll_commands)
+        
+    def run_command(self, request):
+        """在界面线程中执行命令服务转来的命令"""
+        command = request["cmd"]
+        notebook = self.notebook
+        if command == "focus":
+            self.root.deiconify()
+            self.root.lift()
+            self.root.focus_force()
+            return {"ok": True}
+        if notebook.loading or request.get("notebook") not in (None, notebook.name):
+            return {"ok": False, "error": "当前笔记本不可用", "fallback": True}
+        if command in ("list", "search", "get"):
+            return self.read_command(notebook, command, request)
+        if command == "add":
+            note = self.create_note(request.get("title"), request.get("content", "").strip(),
+                                    request.get("category") or "常用")
+            self.show_status(f"✨ 已创建新便签: {note.title}")
+            return {"ok": True, "id": note.id}
+        note = notebook.find(request.get("key", ""))
+        if note is None:
+            return {"ok": False, "error": "找不到便签（或匹配不唯一）"}
+        error = self.copy_note(note)
+        if error is not None:
+            return {"ok": False, "error": error}
+        return {"ok": True, "title": note.title}
+        
+    def shutdown(self):
+        """停止命令服务、写入并关闭所有笔记本、取消所有定时回调（之后只能销毁窗口）"""
+        if self.server is not None:
+            self.server.close()
+            self.server = None
+        for card in self.visible_cards.values():
             if card.is_expanded:
                 card.save_card(show_message=False)
+        for notebook in self.loaded_notebooks.values():
+            self.close_notebook(notebook)  # 同步写入剩余数据
+        # 检查文件、保存错误和命令的回调会不断重新登记，窗口销毁后不能再执行
+        for job in self.root.tk.splitlist(self.root.tk.call("after", "info")):
+            self.root.after_cancel(job)
+        
+    def on_closing(self):
+        self.shutdown()
+        self.save_manifest()
         self.save_window_config()
         self.root.destroy()
 
 
 def main():
+    timing = "--timing" in sys.argv[1:] or os.environ.get("STICKY_NOTES_TIMING") == "1"
+    profile = "--profile" in sys.argv[1:] or os.environ.get("STICKY_NOTES_PROFILE") == "1"
+    if "--new-instance" not in sys.argv[1:]:
+        # 已有实例在运行：把它的窗口调到前面，不再启动第二个
+        try:
+            if send_command("focus").get("ok"):
+                return
+        except OSError:
+            pass
     root = tk.Tk()
-    app = StickyNotesCardApp(root)
+    app = StickyNotesCardApp(root, timing=timing, profile=profile)
     root.mainloop()
 
 
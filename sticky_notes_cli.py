@@ -0,0 +1,311 @@
+"""
+置顶便签工具 - 命令行
+不导入 tkinter，适合脚本和快捷键工具一次性查询、复制或添加便签；
+界面程序正在运行时，list/get/search/copy/add 交给它处理，不再读取数据文件
+
+    python sticky_notes_cli.py list [-c 分类]
+    python sticky_notes_cli.py get <id 或标题>
+    python sticky_notes_cli.py add -t 标题 [-c 分类] [内容]
+    python sticky_notes_cli.py search <关键词>
+    python sticky_notes_cli.py copy <id 或标题>
+    python sticky_notes_cli.py import <文件>
+    python sticky_notes_cli.py export <文件>
+"""
+import argparse
+import json
+import os
+import queue
+import shutil
+import subprocess
+import sys
+import uuid
+
+from sticky_notes_core import Note, iter_import_file, open_notebook, send_command, write_export_file
+
+
+def copy_to_clipboard(text):
+    """用系统自带的剪贴板工具复制文本，找不到可用工具时抛出 OSError"""
+    if sys.platform == "win32":
+        # clip 按控制台代码页解释输入，带 BOM 的 UTF-16 才能正确处理中文
+        subprocess.run(["clip"], input=("\ufeff" + text).encode("utf-16-le"), check=True)
+        return
+    if sys.platform == "darwin":
+        env = dict(os.environ, LANG="en_US.UTF-8")
+        subprocess.run(["pbcopy"], input=text.encode("utf-8"), env=env, check=True)
+        return
+    for command in (["wl-copy"], ["xclip", "-selection", "clipboard"], ["xsel", "--clipboard", "--input"]):
+        if shutil.which(command[0]):
+            subprocess.run(command, input=text.encode("utf-8"), check=True)
+            return
+    raise OSError("未找到剪贴板工具（需要 wl-copy、xclip 或 xsel）")
+
+
+def print_notes(notes, as_json=False, limit=None):
+    for i, note in enumerate(notes):
+        if limit is not None and i >= limit:
+            break
+        if as_json:
+            print(json.dumps(note.to_dict(), ensure_ascii=False))
+        else:
+            print(f"{note.id[:8]}  [{note.category}]  {note.title}")
+
+
+def loaded(notebook):
+    """需要内存中的完整列表时才读取数据文件"""
+    if notebook.loading:
+        notebook.load()
+    return notebook
+
+
+def save(notebook, attempts=3):
+    """写入修改；其他实例在此期间写过数据文件时整体重写会被推迟，
+    与界面程序关闭笔记本时相同：先读取并合并对方的修改再重写，仍未写入时抛出 OSError"""
+    store = notebook.store
+    store.flush()
+    for attempt in range(attempts):
+        if not store.write_deferred or notebook.loading:
+            break
+        notes, signature = store.read()
+        notebook.apply_merge(notebook.merge_plan(notes))
+        store.seen = signature
+        store.write_deferred = False
+        store.compact()
+        store.flush()
+    if store.write_deferred:
+        raise OSError("其他实例正在写入数据文件，修改未能保存")
+
+
+def cmd_list(notebook, args):
+    if args.categories:
+        for category, count in sorted(loaded(notebook).category_counts().items(), key=lambda item: -item[1]):
+            print(f"{category}\t{count}")
+        return 0
+    store = notebook.store
+    if store.direct_query:
+        # SQLite 存储只读取需要输出的几行
+        limit = args.limit if args.limit is not None else store.count(args.category)
+        print_notes(store.page(0, limit, args.category), args.json)
+        return 0
+    print_notes(loaded(notebook).search("", args.category), args.json, args.limit)
+    return 0
+
+
+def cmd_search(notebook, args):
+    if notebook.store.direct_query:
+        notes = notebook.store.search(args.query, args.category, args.limit)  # 使用全文索引
+    else:
+        notes = loaded(notebook).search(args.query, args.category)
+    print_notes(notes, args.json, args.limit)
+    return 0 if notes else 1
+
+
+def find_note(notebook, key):
+    note = loaded(notebook).find(key)
+    if note is None:
+        print(f"找不到便签（或匹配不唯一）: {key}", file=sys.stderr)
+    return note
+
+
+def render(notebook, note):
+    """展开模板便签；用到 {counter} 的便签计数加一并写回"""
+    text, counted = notebook.templates.render(note)
+    for owner in counted:
+        notebook.store.put(owner)
+    return text
+
+
+def cmd_get(notebook, args):
+    note = find_note(notebook, args.key)
+    if note is None:
+        return 1
+    if args.json:
+        print(json.dumps(note.to_dict(), ensure_ascii=False, indent=2))
+    else:
+        print(render(notebook, note) if args.expand else note.content)
+    return 0
+
+
+def cmd_copy(notebook, args):
+    note = find_note(notebook, args.key)
+    if note is None:
+        return 1
+    try:
+        copy_to_clipboard(render(notebook, note))
+    except (OSError, subprocess.CalledProcessError) as e:
+        print(f"复制失败: {e}", file=sys.stderr)
+        return 1
+    print(f"✓ 已复制: {note.title}", file=sys.stderr)
+    return 0
+
+
+def cmd_add(notebook, args):
+    loaded(notebook)
+    content = args.content
+    if content is None or content == "-":
+        content = "" if sys.stdin.isatty() else sys.stdin.read()
+    note = Note(
+        id=uuid.uuid4().hex,
+        title=args.title or f"新便签 {len(notebook.notes) + 1}",
+        content=content.strip(),
+        category=args.category,
+        created=Note.now(),
+        rev=1
+    )
+    index = notebook.pinned_count()  # 与界面程序相同，放在置顶便签之后
+    notebook.insert(note, index)
+    notebook.store.put(note, index=index)
+    print(note.id)
+    return 0
+
+
+def cmd_import(notebook, args):
+    notes = [note for position, note in iter_import_file(args.file)]
+    if not notes:
+        print("文件中没有便签", file=sys.stderr)
+        return 1
+    loaded(notebook).prepend(notes)
+    notebook.store.compact()
+    save(notebook)
+    print(f"已导入 {len(notes)} 条便签", file=sys.stderr)
+    return 0
+
+
+def cmd_export(notebook, args):
+    if not notebook.store.direct_query:
+        loaded(notebook)
+    count = write_export_file(args.file, notebook.store.iterate())
+    print(f"已导出 {count} 条便签", file=sys.stderr)
+    return 0
+
+
+def server_request(args):
+    """把命令转换为命令服务的请求；只能直接读写数据文件的命令返回 None"""
+    if args.command in ("list", "search"):
+        if args.command == "list" and args.categories:
+            return None
+        request = {"category": args.category, "limit": args.limit}
+        if args.command == "search":
+            request["query"] = args.query
+        return request
+    if args.command == "get" and args.expand:
+        return None  # 展开会修改计数，直接读写数据文件
+    if args.command in ("get", "copy"):
+        return {"key": args.key}
+    if args.command == "add":
+        if args.content is None or args.content == "-":
+            args.content = "" if sys.stdin.isatty() else sys.stdin.read()
+        return {"title": args.title, "content": args.content, "category": args.category}
+    return None
+
+
+def try_server(args):
+    """交给正在运行的界面程序处理并返回退出码；没有运行中的实例或它无法处理时返回 None"""
+    request = server_request(args)
+    if request is None:
+        return None
+    if args.notebook:
+        request["notebook"] = args.notebook
+    try:
+        response = send_command(args.command, **request)
+    except OSError:
+        return None
+    if not response.get("ok"):
+        if response.get("fallback"):
+            return None
+        print(response.get("error", "失败"), file=sys.stderr)
+        return 1
+    if "notes" in response:
+        notes = [Note.from_dict(data) for data in response["notes"]]
+        print_notes(notes, args.json)
+        return 0 if notes or args.command == "list" else 1
+    if args.command == "get":
+        note = Note.from_dict(response["note"])
+        if args.json:
+            print(json.dumps(note.to_dict(), ensure_ascii=False, indent=2))
+        else:
+            print(note.content)
+    elif args.command == "copy":
+        print(f"✓ 已复制: {response['title']}", file=sys.stderr)
+    else:
+        print(response["id"])
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="置顶便签工具命令行")
+    parser.add_argument("-d", "--dir", help="数据目录（默认为当前目录，与界面程序相同）")
+    parser.add_argument("-b", "--notebook", help="笔记本名称（默认为上次使用的）")
+    parser.add_argument("--offline", action="store_true", help="不连接正在运行的界面程序，直接读写数据文件")
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+
+    command = commands.add_parser("list", help="列出便签")
+    command.add_argument("-c", "--category", help="只列出该分类")
+    command.add_argument("-n", "--limit", type=int)
+    command.add_argument("--json", action="store_true", help="每行输出一条 JSON")
+    command.add_argument("--categories", action="store_true", help="列出各分类的便签数量")
+    command.set_defaults(func=cmd_list)
+
+    command = commands.add_parser("get", help="输出便签内容")
+    command.add_argument("key", help="便签 id、id 前缀或完整标题")
+    command.add_argument("--json", action="store_true")
+    command.add_argument("-e", "--expand", action="store_true", help="展开模板占位符")
+    command.set_defaults(func=cmd_get)
+
+    command = commands.add_parser("add", help="新建便签，输出新便签的 id")
+    command.add_argument("content", nargs="?", help="内容；省略或为 - 时从标准输入读取")
+    command.add_argument("-t", "--title")
+    command.add_argument("-c", "--category", default="常用")
+    command.set_defaults(func=cmd_add)
+
+    command = commands.add_parser("search", help="搜索标题和内容")
+    command.add_argument("query")
+    command.add_argument("-c", "--category")
+    command.add_argument("-n", "--limit", type=int)
+    command.add_argument("--json", action="store_true")
+    command.set_defaults(func=cmd_search)
+
+    command = commands.add_parser("copy", help="复制便签内容到剪贴板")
+    command.add_argument("key", help="便签 id、id 前缀或完整标题")
+    command.set_defaults(func=cmd_copy)
+
+    command = commands.add_parser("import", help="从 CSV 或 JSON Lines 导入")
+    command.add_argument("file")
+    command.set_defaults(func=cmd_import)
+
+    command = commands.add_parser("export", help="导出为 CSV 或 JSON Lines（按扩展名）")
+    command.add_argument("file")
+    command.set_defaults(func=cmd_export)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.dir:
+        os.chdir(args.dir)
+    if not args.offline:
+        status = try_server(args)
+        if status is not None:
+            return status
+    notebook = open_notebook(args.notebook)
+    if notebook is None:
+        print(f"笔记本不存在: {args.notebook}", file=sys.stderr)
+        return 2
+    try:
+        status = args.func(notebook, args)
+        save(notebook)
+    except (OSError, ValueError) as e:  # TemplateError 也是 ValueError
+        print(f"错误: {e}", file=sys.stderr)
+        status = 1
+    finally:
+        notebook.store.close()  # 写入尚未保存的修改
+    try:
+        error = notebook.store.errors.get_nowait()
+    except queue.Empty:
+        return status
+    print(f"保存失败: {error}", file=sys.stderr)
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,1873 @@
+"""
+置顶便签工具 - 核心库
+便签数据、存储、搜索、笔记本和导入导出，不依赖 tkinter；界面和命令行工具都通过它读写数据
+"""
+import calendar
+import codecs
+import csv
+import hmac
+import itertools
+import json
+import os
+import queue
+import re
+import socket
+import socketserver
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime
+
+DATA_FILE = "sticky_notes_data.json"
+CONFIG_FILE = "window_config.json"
+MANIFEST_FILE = "sticky_notes_notebooks.json"
+PORT_FILE = "sticky_notes.port"
+
+UMASK = os.umask(0)  # 启动时读取一次（只能通过设置来读取，不能在写入线程中调用）
+os.umask(UMASK)
+
+
+def atomic_write_json(path, data, private=False):
+    """先写入同目录临时文件并 fsync，再原子替换目标文件，崩溃时不会留下写了一半的文件
+    
+    临时文件只有本用户可读写；替换前改为原文件的权限（新文件按 umask），private 为 True 时保持仅本用户可读写。
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=".tmp_", suffix=".json", dir=directory)
+    try:
+        if not private:
+            try:
+                mode = os.stat(path).st_mode & 0o7777
+            except FileNotFoundError:
+                mode = 0o666 & ~UMASK
+            os.chmod(tmp_path, mode)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class Note:
+    """一条便签在内存中的紧凑表示
+    
+    __slots__ 省去每条便签各自的属性字典；分类经 intern 后所有便签共用同一个字符串对象；
+    创建时间存为秒数。读写数据文件时通过 from_dict()/to_dict() 与原 JSON 格式互相转换，
+    文件格式不变，不认识的字段原样保存在 extra 中。
+    """
+    __slots__ = ("id", "title", "content", "category", "created", "rev", "extra")
+    fields = ("id", "title", "content", "category", "created_at", "rev")
+    
+    def __init__(self, id="", title="", content="", category="常用", created=0, rev=0, extra=None):
+        self.id = id
+        self.title = title
+        self.content = content
+        self.category = sys.intern(category)
+        self.created = created        # 本地时间按 UTC 规则换算的秒数，往返转换不受时区影响
+        self.rev = rev                # 修订号，多个实例合并时较大的优先
+        self.extra = extra            # 其他字段，没有时为 None
+        
+    @staticmethod
+    def parse_time(text):
+        """"YYYY-MM-DD HH:MM:SS" -> 秒数（比 strptime 快一个数量级）；格式不符时返回 None"""
+        if not isinstance(text, str) or len(text) != 19:
+            return None
+        try:
+            return calendar.timegm((int(text[0:4]), int(text[5:7]), int(text[8:10]),
+                                    int(text[11:13]), int(text[14:16]), int(text[17:19])))
+        except ValueError:
+            return None
+            
+    @staticmethod
+    def format_time(seconds):
+        return "%04d-%02d-%02d %02d:%02d:%02d" % time.gmtime(seconds)[:6]
+        
+    @staticmethod
+    def now():
+        return calendar.timegm(time.localtime())
+        
+    @classmethod
+    def from_dict(cls, data):
+        extra = {key: value for key, value in data.items() if key not in cls.fields}
+        created = cls.parse_time(data.get("created_at"))
+        if created is None:
+            created = 0
+            if "created_at" in data:
+                extra["created_at"] = data["created_at"]  # 无法识别的时间原样保留
+        return cls(data.get("id") or "", data.get("title", ""), data.get("content", ""),
+                   data.get("category") or "常用", created, data.get("rev", 0), extra or None)
+        
+    def to_dict(self):
+        data = {
+            "id": self.id,
+            "title": self.title,
+            "content": self.content,
+            "category": self.category,
+            "created_at": self.format_time(self.created) if self.created else "",
+        }
+        if self.rev:
+            data["rev"] = self.rev
+        if self.extra:
+            data.update(self.extra)
+        return data
+        
+    @property
+    def pinned(self):
+        """置顶标记保存在 extra 中，数据文件里是 "pinned": true，没有置顶的便签不多占空间"""
+        return bool(self.extra and self.extra.get("pinned"))
+        
+    @pinned.setter
+    def pinned(self, value):
+        if value:
+            if self.extra is None:
+                self.extra = {}
+            self.extra["pinned"] = True
+        elif self.extra:
+            self.extra.pop("pinned", None)
+            self.extra = self.extra or None
+            
+    def update_from(self, other):
+        """原地替换为另一条记录的内容（引用这条便签的卡片和列表不受影响）"""
+        for name in self.__slots__:
+            setattr(self, name, getattr(other, name))
+
+
+class SaveWorker:
+    """后台保存线程 - 合并短时间内的多次保存请求，在界面线程之外执行写入"""
+    def __init__(self, write_func, delay=0.5, max_delay=3.0):
+        self.write_func = write_func
+        self.delay = delay            # 最后一次请求后静默多久才写入
+        self.max_delay = max_delay    # 连续请求时最长推迟时间
+        self.errors = queue.Queue()   # 写入异常，由界面线程取出提示
+        
+        self.cond = threading.Condition()
+        self.write_lock = threading.Lock()
+        self.pending = False
+        self.first_request = 0.0
+        self.last_request = 0.0
+        self.stopped = False
+        
+        self.thread = threading.Thread(target=self.run, name="SaveWorker", daemon=True)
+        self.thread.start()
+        
+    def request(self):
+        """请求保存，立即返回"""
+        with self.cond:
+            now = time.monotonic()
+            if not self.pending:
+                self.pending = True
+                self.first_request = now
+            self.last_request = now
+            self.cond.notify()
+            
+    def run(self):
+        while True:
+            with self.cond:
+                while not self.pending and not self.stopped:
+                    self.cond.wait()
+                if self.stopped:
+                    return
+                # 防抖：等待请求停止一段时间，但不超过 max_delay
+                while self.pending and not self.stopped:
+                    deadline = min(self.last_request + self.delay,
+                                   self.first_request + self.max_delay)
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.cond.wait(remaining)
+                if not self.pending or self.stopped:
+                    continue
+                self.pending = False
+            self.write_now()
+            
+    def write_now(self):
+        with self.write_lock:
+            try:
+                self.write_func()
+            except Exception as e:
+                self.errors.put(e)
+                
+    def flush(self):
+        """同步写入尚未保存的数据；若后台正在写入则等待其完成"""
+        with self.cond:
+            pending = self.pending
+            self.pending = False
+        if pending:
+            self.write_now()
+        else:
+            with self.write_lock:
+                pass
+                
+    def stop(self):
+        self.flush()
+        with self.cond:
+            self.stopped = True
+            self.cond.notify()
+        self.thread.join(timeout=5)
+
+
+def process_alive(pid):
+    """本机上的进程是否仍在运行"""
+    if sys.platform == "win32":
+        import ctypes
+        kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+        handle = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return ctypes.get_last_error() == 5  # 拒绝访问：进程存在，属于其他用户
+        exit_code = ctypes.c_ulong()
+        kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code))
+        kernel32.CloseHandle(handle)
+        return exit_code.value == 259  # STILL_ACTIVE
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class FileLock:
+    """锁文件 - 串行化多个实例（或网络共享上的多台电脑）对同一数据文件的写入
+    
+    锁文件内容为 "主机名 进程号"。本机的持有者已退出（崩溃）时立即清除；
+    其他电脑留下的锁文件无法确认，超过 stale_after 秒视为失效，等待时间比它长。
+    """
+    stale_after = 30.0
+    
+    def __init__(self, path, timeout=None):
+        self.path = path + ".lock"
+        self.timeout = timeout if timeout is not None else self.stale_after + 10
+        
+    def stale(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                host, pid = f.read().split()
+            if host == socket.gethostname() and not process_alive(int(pid)):
+                return True
+        except ValueError:
+            pass  # 旧格式或刚创建、尚未写入内容
+        return time.time() - os.path.getmtime(self.path) > self.stale_after
+        
+    def __enter__(self):
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                try:
+                    if self.stale():
+                        os.remove(self.path)
+                        continue
+                except OSError:
+                    continue  # 锁文件刚被释放
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"等待锁文件超时: {self.path}")
+                time.sleep(0.05)
+                continue
+            os.write(fd, f"{socket.gethostname()} {os.getpid()}".encode("utf-8"))
+            os.close(fd)
+            return self
+            
+    def __exit__(self, *exc_info):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+class PendingRecords:
+    """待写入的修改记录 - 按发生顺序保存
+    
+    插入位置是按当时的列表计算的，写入时必须保持原来的先后顺序；
+    只有不改变位置的修改才并入该便签之前尚未写入的 put 记录，连续编辑同一便签只写一条。
+    """
+    def __init__(self):
+        self.records = []
+        self.puts = {}          # 便签 id -> 它最近一条 put 记录在 records 中的位置
+        
+    def __len__(self):
+        return len(self.records)
+        
+    def last_put(self, note_id):
+        position = self.puts.get(note_id)
+        return None if position is None else self.records[position]
+        
+    def put(self, note_id, record, merge):
+        """追加该便签的 put 记录；merge 为 True 且之前有 put 记录时原地替换"""
+        position = self.puts.get(note_id) if merge else None
+        if position is not None:
+            self.records[position] = record
+            return
+        self.puts[note_id] = len(self.records)
+        self.records.append(record)
+        
+    def append(self, record, note_id=None):
+        """追加删除、移动等记录；删除之后的修改不能再并入删除之前的记录"""
+        if note_id is not None:
+            self.puts.pop(note_id, None)
+        self.records.append(record)
+        
+    def take(self):
+        records = self.records
+        self.records = []
+        self.puts = {}
+        return records
+
+
+class NoteStore:
+    """便签存储接口
+    
+    load() 读取全部便签；put()/delete() 记录单条修改、move() 记录单条便签移动到哪两条之间，
+    由后台线程按发生顺序写入（write()）；
+    compact() 请求按内存中的完整列表重写；page()/count() 支持分页读取。
+    direct_query 为 True 的存储可以不 load() 直接用 page()/count()/search() 查询（命令行用）。
+    load() 可以在后台线程中调用。
+    
+    写入时持有锁文件。其他实例修改过数据文件时（签名与 seen 不同），
+    不会覆盖全部数据的写入推迟到界面合并之后（write_deferred），单条记录照常写入。
+    """
+    direct_query = False
+    
+    def __init__(self, path, get_notes):
+        self.path = path
+        self.get_notes = get_notes
+        self.needs_compact = False    # load() 发现需要重写时置位，由调用方在数据就绪后 compact()
+        self.write_deferred = False   # 因外部修改推迟了整体重写，合并后由调用方 compact()
+        self.seen = None              # 最近一次读取或写入后的文件签名
+        self.written_ids = set()      # 本实例写入文件的便签 id（后台线程持有锁文件时添加）
+        self.read_written_ids = set() # 最近一次 read() 之前写入的，合并时与读到的 id 同样看待
+        self.file_lock = FileLock(self.watch_paths()[0])
+        self.saver = SaveWorker(self.locked_write)
+        self.errors = self.saver.errors
+        
+    def watch_paths(self):
+        return [self.path]
+        
+    def signature(self):
+        """各数据文件的修改时间和大小，只调用 stat，开销很小"""
+        result = []
+        for path in self.watch_paths():
+            try:
+                stat = os.stat(path)
+                result.append((stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                result.append(None)
+        return tuple(result)
+        
+    def external_changed(self, wait=True):
+        """wait 为 False 时不等待正在进行的写入（界面线程每秒检查用），写入中视为没有变化"""
+        return self.seen is not None and self.signature() != self.seen
+        
+    def read(self):
+        """持有锁文件读取，返回 (便签列表, 读取前的签名)；数据装入内存后调用方把签名设为 seen"""
+        with self.file_lock:
+            signature = self.signature()
+            notes = self.load()
+            self.read_written_ids, self.written_ids = self.written_ids, set()
+            return notes, signature
+            
+    def locked_write(self):
+        with self.file_lock:
+            external = self.external_changed()
+            self.write(external)
+            if not external:
+                self.seen = self.signature()
+        
+    def count(self, category=None):
+        notes = self.get_notes()
+        if category is None:
+            return len(notes)
+        return sum(1 for note in notes if note.category == category)
+        
+    def page(self, offset, limit, category=None):
+        notes = self.get_notes()
+        if category is not None:
+            notes = [note for note in notes if note.category == category]
+        return notes[offset:offset + limit]
+        
+    def iterate(self, chunk=500):
+        """按页逐批取出全部便签，导出时不必一次读入"""
+        offset = 0
+        while True:
+            notes = self.page(offset, chunk)
+            if not notes:
+                return
+            yield from notes
+            offset += len(notes)
+            
+    def load(self):
+        """返回按顺序排列的全部便签"""
+        raise NotImplementedError
+        
+    def put(self, note, index=None):
+        """新建或修改一条便签；新建时 index 为它在列表中的位置（None 表示末尾）"""
+        raise NotImplementedError
+        
+    def delete(self, note_id):
+        raise NotImplementedError
+        
+    def move(self, note_id, after, before):
+        """便签移到 id 为 after 和 before 的两条之间（None 表示列表开头或末尾）"""
+        raise NotImplementedError
+        
+    def compact(self):
+        raise NotImplementedError
+        
+    def write(self, external):
+        """在后台线程中持有锁文件写入；external 为 True 时其他实例改过文件，不能整体重写"""
+        raise NotImplementedError
+        
+    def flush(self):
+        self.saver.flush()
+        
+    def close(self):
+        self.saver.stop()
+
+
+class JsonStore(NoteStore):
+    """整文件 JSON 存储 - 每次保存重写整个数据文件"""
+    def load(self):
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, 'r', encoding='utf-8') as f:
+            return [Note.from_dict(data) for data in json.load(f)]
+            
+    def put(self, note, index=None):
+        self.saver.request()
+        
+    def delete(self, note_id):
+        self.saver.request()
+        
+    def move(self, note_id, after, before):
+        self.saver.request()
+        
+    def compact(self):
+        self.saver.request()
+        
+    def write(self, external):
+        # 在后台线程中执行：先复制一份快照，再序列化写入
+        if external:
+            self.write_deferred = True  # 整文件重写会覆盖其他实例的修改
+            return
+        notes = list(self.get_notes())
+        atomic_write_json(self.path, [note.to_dict() for note in notes])
+        self.written_ids.update(note.id for note in notes)
+
+
+class JournalStore(NoteStore):
+    """追加日志存储 - 快照文件 + 日志文件
+    
+    每次新建/修改/删除只向日志追加一行 JSON 记录，开销只与该条便签大小有关；
+    启动时读取快照再重放日志；日志记录数超过阈值时把当前数据写成新快照并清空日志。
+    快照沿用原来的 sticky_notes_data.json 格式，旧数据文件无需转换即可读取。
+    """
+    compact_threshold = 1000
+    
+    def __init__(self, path, get_notes):
+        self.journal_path = os.path.splitext(path)[0] + ".journal.jsonl"
+        self.lock = threading.Lock()
+        self.pending = PendingRecords()
+        self.journal_records = 0
+        self.compact_requested = False
+        super().__init__(path, get_notes)
+        
+    def watch_paths(self):
+        return [self.path, self.journal_path]
+        
+    def load(self):
+        notes = []
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                notes = [Note.from_dict(data) for data in json.load(f)]
+        by_id = {note.id: note for note in notes if note.id}
+        
+        self.journal_records = 0
+        damaged = False
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        damaged = True  # 崩溃时写了一半的行
+                        continue
+                    self.apply(notes, by_id, record)
+                    self.journal_records += 1
+        if damaged or self.journal_records >= self.compact_threshold:
+            self.needs_compact = True
+        return notes
+        
+    @staticmethod
+    def apply(notes, by_id, record):
+        """把一条日志记录应用到便签列表（重复应用结果不变）"""
+        if record.get("op") == "put":
+            note = Note.from_dict(record["note"])
+            existing = by_id.get(note.id)
+            if existing is not None:
+                existing.update_from(note)
+            else:
+                notes.insert(record.get("at", len(notes)), note)
+                by_id[note.id] = note
+        elif record.get("op") == "del":
+            note = by_id.pop(record["id"], None)
+            if note is not None:
+                notes.remove(note)
+        elif record.get("op") == "move":
+            # 按前后相邻的便签定位；都已不存在时留在原处
+            note = by_id.get(record["id"])
+            if note is None:
+                return
+            index = notes.index(note)
+            del notes[index]
+            after = by_id.get(record.get("after"))
+            before = by_id.get(record.get("before"))
+            if after is not None:
+                index = notes.index(after) + 1
+            elif before is not None:
+                index = notes.index(before)
+            elif record.get("after") is None:
+                index = 0
+            notes.insert(index, note)
+                
+    def put(self, note, index=None):
+        record = {"op": "put", "note": note.to_dict()}
+        with self.lock:
+            previous = self.pending.last_put(note.id)
+            if index is not None:
+                record["at"] = index
+            elif previous is not None and "at" in previous:
+                record["at"] = previous["at"]  # 合并后仍保留插入位置
+            self.pending.put(note.id, record, merge=index is None)
+        self.saver.request()
+        
+    def delete(self, note_id):
+        with self.lock:
+            self.pending.append({"op": "del", "id": note_id}, note_id)
+        self.saver.request()
+        
+    def move(self, note_id, after, before):
+        record = {"op": "move", "id": note_id, "after": after, "before": before}
+        with self.lock:
+            self.pending.append(record)
+        self.saver.request()
+        
+    def compact(self):
+        with self.lock:
+            self.compact_requested = True
+        self.saver.request()
+        
+    def write(self, external):
+        # 在后台线程中执行；日志只追加单条记录，有外部修改时也可以照常写入
+        with self.lock:
+            records = self.pending.take()
+            compact = self.compact_requested
+            self.compact_requested = False
+        
+        if records:
+            with open(self.journal_path, 'a', encoding='utf-8') as f:
+                for record in records:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self.journal_records += len(records)
+            self.written_ids.update(record["note"]["id"] for record in records if record["op"] == "put")
+        
+        if external and (compact or self.journal_records >= self.compact_threshold):
+            self.write_deferred = True
+        elif compact or self.journal_records >= self.compact_threshold:
+            # 日志里的记录都已包含在快照中；先写快照再清空日志，中途崩溃重放也不会出错
+            notes = list(self.get_notes())
+            atomic_write_json(self.path, [note.to_dict() for note in notes])
+            open(self.journal_path, 'w', encoding='utf-8').close()
+            self.written_ids.update(note.id for note in notes)
+            self.journal_records = 0
+
+
+class SqliteStore(NoteStore):
+    """SQLite 存储 - 适合数万条便签
+    
+    分类、创建时间、标题建索引，内容建 FTS5 全文索引；WAL 模式下单条修改只写一行。
+    首次使用时自动导入原 JSON 数据文件。
+    """
+    columns = ("id", "title", "content", "category", "created_at")
+    migrated_version = 1  # PRAGMA user_version 不小于此值：已导入原数据，数据库为准
+    
+    def __init__(self, path, get_notes):
+        self.db_path = os.path.splitext(path)[0] + ".db"
+        self.lock = threading.Lock()
+        self.pending = PendingRecords()
+        self.compact_requested = False
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn_lock = threading.Lock()
+        self.fts = None               # None: 不支持 FTS5；"trigram"/"unicode61": 分词方式
+        self.create_schema()
+        # 尚未从原 JSON 数据文件导入时只能 load()；导入完成后在 user_version 中记录，
+        # 之后即使删光了全部便签也不再重新导入
+        self.direct_query = self.query("PRAGMA user_version")[0][0] >= self.migrated_version
+        if not self.direct_query and (self.query("SELECT 1 FROM notes LIMIT 1") or not self.has_legacy_data(path)):
+            self.mark_migrated()  # 新建的数据库，或旧版本中已导入过的
+        super().__init__(path, get_notes)
+        
+    def watch_paths(self):
+        return [self.db_path]
+        
+    def signature(self):
+        # 其他连接提交事务后 data_version 才会变化，本连接自己的写入不影响
+        with self.conn_lock:
+            return self.conn.execute("PRAGMA data_version").fetchone()[0]
+        
+    def external_changed(self, wait=True):
+        # 后台写入在整个事务期间持有连接（整理大量便签时可能持续数秒），界面线程不能等待
+        if not self.conn_lock.acquire(blocking=wait):
+            return False
+        try:
+            version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+        finally:
+            self.conn_lock.release()
+        return self.seen is not None and version != self.seen
+        
+    def create_schema(self):
+        conn = self.conn
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS notes (
+                id TEXT PRIMARY KEY,
+                position REAL NOT NULL,
+                title TEXT NOT NULL DEFAULT '',
+                content TEXT NOT NULL DEFAULT '',
+                category TEXT NOT NULL DEFAULT '常用',
+                created_at TEXT NOT NULL DEFAULT '',
+                extra TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_notes_position ON notes(position);
+            CREATE INDEX IF NOT EXISTS idx_notes_category ON notes(category, position);
+            CREATE INDEX IF NOT EXISTS idx_notes_created_at ON notes(created_at);
+            CREATE INDEX IF NOT EXISTS idx_notes_title ON notes(title);
+        """)
+        # 中文没有空格分词，优先使用 trigram 分词器（SQLite 3.34+）
+        for tokenizer in ("trigram", "unicode61"):
+            try:
+                conn.execute(
+                    "CREATE VIRTUAL TABLE IF NOT EXISTS notes_fts USING fts5("
+                    "title, content, content='notes', content_rowid='rowid', "
+                    f"tokenize='{tokenizer}')"
+                )
+            except sqlite3.OperationalError:
+                continue
+            self.fts = tokenizer
+            break
+        if self.fts:
+            conn.executescript("""
+                CREATE TRIGGER IF NOT EXISTS notes_ai AFTER INSERT ON notes BEGIN
+                    INSERT INTO notes_fts(rowid, title, content) VALUES (new.rowid, new.title, new.content);
+                END;
+                CREATE TRIGGER IF NOT EXISTS notes_ad AFTER DELETE ON notes BEGIN
+                    INSERT INTO notes_fts(notes_fts, rowid, title, content)
+                        VALUES ('delete', old.rowid, old.title, old.content);
+                END;
+                DROP TRIGGER IF EXISTS notes_au;
+                CREATE TRIGGER notes_au AFTER UPDATE OF title, content ON notes
+                WHEN old.title IS NOT new.title OR old.content IS NOT new.content BEGIN
+                    INSERT INTO notes_fts(notes_fts, rowid, title, content)
+                        VALUES ('delete', old.rowid, old.title, old.content);
+                    INSERT INTO notes_fts(rowid, title, content) VALUES (new.rowid, new.title, new.content);
+                END;
+            """)
+        conn.commit()
+        
+    @classmethod
+    def row_to_note(cls, row):
+        data = {key: row[key] for key in cls.columns}
+        if row["extra"]:
+            data.update(json.loads(row["extra"]))
+        return Note.from_dict(data)
+        
+    @classmethod
+    def note_to_row(cls, note):
+        data = note.to_dict()
+        extra = {key: value for key, value in data.items() if key not in cls.columns}
+        return (
+            note.id,
+            note.title,
+            note.content,
+            note.category,
+            data["created_at"],
+            json.dumps(extra, ensure_ascii=False) if extra else None,
+        )
+        
+    def query(self, sql, params=()):
+        with self.conn_lock:
+            return self.conn.execute(sql, params).fetchall()
+        
+    @staticmethod
+    def has_legacy_data(path):
+        """原 JSON 数据文件或追加日志（可能只有日志、还没有快照）"""
+        return os.path.exists(path) or os.path.exists(os.path.splitext(path)[0] + ".journal.jsonl")
+        
+    def mark_migrated(self):
+        # 整理时与写入的便签在同一次提交中生效；调用方负责 conn_lock
+        self.conn.execute(f"PRAGMA user_version = {self.migrated_version}")
+        self.conn.commit()
+        self.direct_query = True
+        
+    def load(self):
+        if not self.direct_query:
+            return self.migrate()
+        rows = self.query("SELECT * FROM notes ORDER BY position")
+        return [self.row_to_note(row) for row in rows]
+        
+    def migrate(self):
+        """从原 JSON 数据文件（含追加日志）导入"""
+        legacy = JournalStore(self.path, lambda: notes)
+        notes = legacy.load()
+        legacy.close()
+        for note in notes:
+            if not note.id:
+                note.id = uuid.uuid4().hex
+        self.needs_compact = True
+        return notes
+        
+    def count(self, category=None):
+        if category is None:
+            return self.query("SELECT COUNT(*) FROM notes")[0][0]
+        return self.query("SELECT COUNT(*) FROM notes WHERE category = ?", (category,))[0][0]
+        
+    def page(self, offset, limit, category=None):
+        if category is None:
+            rows = self.query(
+                "SELECT * FROM notes ORDER BY position LIMIT ? OFFSET ?", (limit, offset))
+        else:
+            rows = self.query(
+                "SELECT * FROM notes WHERE category = ? ORDER BY position LIMIT ? OFFSET ?",
+                (category, limit, offset))
+        return [self.row_to_note(row) for row in rows]
+        
+    def search(self, query, category=None, limit=None):
+        """与 Notebook.search 相同：标题或内容包含全部搜索词，结果按列表顺序
+        
+        三个字以上的词用 trigram 全文索引查找，较短的词（或不支持 trigram 时）用 LIKE 逐行比对。
+        """
+        conditions = []
+        params = []
+        terms = query.lower().split()
+        phrases = [term for term in terms if self.fts == "trigram" and len(term) >= 3]
+        if phrases:
+            conditions.append("rowid IN (SELECT rowid FROM notes_fts WHERE notes_fts MATCH ?)")
+            params.append(" ".join('"' + term.replace('"', '""') + '"' for term in phrases))
+        for term in terms:
+            if term not in phrases:
+                pattern = "%" + term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+                conditions.append("(title LIKE ? ESCAPE '\\' OR content LIKE ? ESCAPE '\\')")
+                params += [pattern, pattern]
+        if category is not None:
+            conditions.append("category = ?")
+            params.append(category)
+        sql = "SELECT * FROM notes"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY position"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        return [self.row_to_note(row) for row in self.query(sql, params)]
+        
+    def put(self, note, index=None):
+        row = self.note_to_row(note)  # 在界面线程中取快照
+        with self.lock:
+            previous = self.pending.last_put(note.id)
+            merge = index is None
+            if merge and previous is not None:
+                index = previous[2]  # 合并后仍保留插入位置
+            self.pending.put(note.id, ("put", row, index), merge)
+        self.saver.request()
+        
+    def delete(self, note_id):
+        with self.lock:
+            self.pending.append(("del", (note_id,), None), note_id)
+        self.saver.request()
+        
+    def move(self, note_id, after, before):
+        with self.lock:
+            self.pending.append(("move", (after, before), note_id))
+        self.saver.request()
+        
+    def compact(self):
+        with self.lock:
+            self.compact_requested = True
+        self.saver.request()
+        
+    def new_position(self, index):
+        """计算插入到第 index 条之前的排序值"""
+        if index is None:
+            row = self.conn.execute("SELECT MAX(position) FROM notes").fetchone()
+            return (row[0] if row[0] is not None else 0) + 1
+        if index <= 0:
+            row = self.conn.execute("SELECT MIN(position) FROM notes").fetchone()
+            return (row[0] if row[0] is not None else 0) - 1
+        rows = self.conn.execute(
+            "SELECT position FROM notes ORDER BY position LIMIT 2 OFFSET ?", (index - 1,)).fetchall()
+        if not rows:
+            return self.new_position(None)
+        if len(rows) == 1:
+            return rows[0][0] + 1
+        return (rows[0][0] + rows[1][0]) / 2
+        
+    def move_position(self, note_id, after, before, renumbered=False):
+        """移动一条便签：position 取前后两条的中点，只更新这一行；浮点间隔用尽时整表重新编号"""
+        def scalar(sql, params):
+            row = self.conn.execute(sql, params).fetchone()
+            return row[0] if row else None
+        
+        if after is None:
+            first = scalar("SELECT MIN(position) FROM notes WHERE id != ?", (note_id,))
+            position = (first if first is not None else 0) - 1
+        elif before is None:
+            last = scalar("SELECT MAX(position) FROM notes WHERE id != ?", (note_id,))
+            position = (last if last is not None else 0) + 1
+        else:
+            low = scalar("SELECT position FROM notes WHERE id = ?", (after,))
+            high = scalar("SELECT position FROM notes WHERE id = ?", (before,))
+            if low is None and high is None:
+                return  # 相邻的便签都已被删除，留在原处
+            if low is None:
+                low = scalar("SELECT MAX(position) FROM notes WHERE position < ? AND id != ?",
+                             (high, note_id))
+                low = high - 2 if low is None else low
+            if high is None or (renumbered and high <= low):
+                # 其他实例改过顺序时前后两条可能已不相邻，以前一条为准
+                high = scalar("SELECT MIN(position) FROM notes WHERE position > ? AND id != ?",
+                              (low, note_id))
+                high = low + 2 if high is None else high
+            position = (low + high) / 2
+            if not low < position < high:
+                rows = self.conn.execute("SELECT id FROM notes ORDER BY position").fetchall()
+                self.conn.executemany("UPDATE notes SET position = ? WHERE id = ?",
+                                      ((i, row[0]) for i, row in enumerate(rows)))
+                return self.move_position(note_id, after, before, renumbered=True)
+        self.conn.execute("UPDATE notes SET position = ? WHERE id = ?", (position, note_id))
+        
+    def write(self, external):
+        # 在后台线程中执行：所有待写修改按发生顺序在一个事务中完成
+        with self.lock:
+            records = self.pending.take()
+            compact = self.compact_requested
+            self.compact_requested = False
+        if compact and external:
+            self.write_deferred = True  # 整表重写会删除其他实例新增的便签
+            compact = False
+        
+        with self.conn_lock, self.conn:
+            if compact:
+                # 按 id 对比整表重写：已有的行只改写字段和位置，标题和内容没变时全文索引不必更新
+                rows = [self.note_to_row(note) for note in list(self.get_notes())]
+                existing = {row[0] for row in self.conn.execute("SELECT id FROM notes")}
+                kept = {row[0] for row in rows}
+                self.conn.executemany(
+                    "DELETE FROM notes WHERE id = ?", ((note_id,) for note_id in existing - kept))
+                self.conn.executemany(
+                    "UPDATE notes SET title = ?, content = ?, category = ?, created_at = ?, extra = ?, "
+                    "position = ? WHERE id = ?",
+                    (row[1:] + (i, row[0]) for i, row in enumerate(rows) if row[0] in existing))
+                self.conn.executemany(
+                    "INSERT INTO notes (id, title, content, category, created_at, extra, position) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (row + (i,) for i, row in enumerate(rows) if row[0] not in existing))
+                records = []
+                self.written_ids.update(kept)
+                if not self.direct_query:
+                    self.mark_migrated()  # 导入的便签已全部写入
+            for op, row, index in records:
+                if op == "del":
+                    self.conn.execute("DELETE FROM notes WHERE id = ?", row)
+                    continue
+                if op == "move":
+                    self.move_position(index, *row)
+                    continue
+                cursor = self.conn.execute(
+                    "UPDATE notes SET title = ?, content = ?, category = ?, created_at = ?, extra = ? "
+                    "WHERE id = ?", row[1:] + row[:1])
+                if cursor.rowcount == 0:
+                    self.conn.execute(
+                        "INSERT INTO notes (id, title, content, category, created_at, extra, position) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?)", row + (self.new_position(index),))
+                    self.written_ids.add(row[0])
+                        
+    def close(self):
+        super().close()
+        self.conn.close()
+
+
+class SearchIndex:
+    """标题和内容的增量倒排索引
+    
+    中文没有空格分词，只按相邻两字（bigram）建立倒排表，标题和内容末尾各补一个换行，
+    每个字都是某个两字组合的开头：单字查询取以它开头的各倒排表的并集，更长的词求交集后
+    再到便签字段中校验是否连续出现，数字编号的前缀和中间片段也能查到。
+    倒排表直接保存便签对象，不另存文本副本；另按分类保存便签集合，分类筛选只需求交集。
+    """
+    def __init__(self):
+        self.postings = {}     # 两字 -> 便签集合
+        self.starts = {}       # 字 -> 以它开头、倒排表非空的两字
+        self.categories = {}   # 分类 -> 已建索引的便签集合
+        
+    @staticmethod
+    def grams(title, content):
+        grams = set()
+        for text in (f"{title}\n".lower(), f"{content}\n".lower()):
+            grams.update(text[i:i + 2] for i in range(len(text) - 1))
+        return grams
+        
+    def add_grams(self, note, grams):
+        postings = self.postings
+        for gram in grams:
+            notes = postings.get(gram)
+            if notes is None:
+                notes = postings[gram] = set()
+                self.starts.setdefault(gram[0], set()).add(gram)
+            notes.add(note)
+            
+    def remove_grams(self, note, grams):
+        postings = self.postings
+        for gram in grams:
+            notes = postings.get(gram)
+            if notes is None:
+                continue  # 该便签还在分批建立索引的队列中
+            notes.discard(note)
+            if not notes:
+                del postings[gram]
+                self.starts[gram[0]].discard(gram)
+                
+    def add(self, note):
+        """为新便签建立索引（重复调用结果不变）"""
+        self.add_grams(note, self.grams(note.title, note.content))
+        self.categories.setdefault(note.category, set()).add(note)
+        
+    def remove(self, note):
+        """按便签当前的字段移除索引，须在修改字段之前调用"""
+        self.remove_grams(note, self.grams(note.title, note.content))
+        members = self.categories.get(note.category)
+        if members is not None:
+            members.discard(note)
+            
+    def update(self, note, old):
+        """字段已修改，old 为修改前的值（只含有变化的字段），只增删有差别的两字"""
+        if "title" in old or "content" in old:
+            old_grams = self.grams(old.get("title", note.title), old.get("content", note.content))
+            new_grams = self.grams(note.title, note.content)
+            self.remove_grams(note, old_grams - new_grams)
+            self.add_grams(note, new_grams - old_grams)
+        if "category" in old and old["category"] != note.category:
+            members = self.categories.get(old["category"])
+            if members is not None:
+                members.discard(note)
+            self.categories.setdefault(note.category, set()).add(note)
+            
+    def term_notes(self, term):
+        """包含 term 的候选便签；一两个字时就是精确结果"""
+        if len(term) == 1:
+            grams = self.starts.get(term)
+            if not grams:
+                return set()
+            notes = sorted((self.postings[gram] for gram in grams), key=len, reverse=True)
+            return notes[0].union(*notes[1:])  # 从最大的集合开始，减少扩容次数
+        notes = []
+        for i in range(len(term) - 1):
+            gram_notes = self.postings.get(term[i:i + 2])
+            if not gram_notes:
+                return set()
+            notes.append(gram_notes)
+        notes.sort(key=len)
+        return notes[0].intersection(*notes[1:])
+        
+    @staticmethod
+    def matcher(terms):
+        """返回判断便签是否包含全部搜索词的函数；词中没有大小写字母时不必转换便签文本"""
+        if len(terms) == 1 and terms[0].upper() == terms[0]:
+            term = terms[0]  # 最常见的情况：一个编号或中文词
+            return lambda note: term in note.title or term in note.content
+        if all(term.upper() == term for term in terms):
+            return lambda note: all(term in note.title or term in note.content for term in terms)
+        return lambda note: all(term in f"{note.title}\n{note.content}".lower() for term in terms)
+        
+    def search(self, query, category=None):
+        """返回匹配的便签集合（category 不为 None 时只含该分类）；查询为空时返回 None（不过滤）"""
+        terms = query.lower().split()
+        if not terms:
+            return None
+        candidates = [self.term_notes(term) for term in terms]
+        if category is not None:
+            candidates.append(self.categories.get(category, set()))
+        if len(candidates) == 1:
+            hits = candidates[0]  # term_notes 返回的已是新集合
+        else:
+            candidates.sort(key=len)
+            hits = candidates[0].intersection(*candidates[1:])
+        long_terms = [term for term in terms if len(term) > 2]
+        if long_terms and hits:
+            hits = set(filter(self.matcher(long_terms), hits))
+        return hits
+
+
+STORAGE_BACKENDS = {
+    "json": JsonStore,
+    "journal": JournalStore,
+    "sqlite": SqliteStore,
+}
+
+
+class UndoHistory:
+    """撤销/重做记录 - 只保存操作本身，不保存整份快照；超过上限时丢弃最早的记录
+    
+    ("insert", [(位置, 便签)])、("delete", [(位置, 便签)])、("edit", 便签 id, 原值, 新值)，
+    编辑记录只包含有变化的字段。
+    """
+    def __init__(self, limit=200):
+        self.undo_stack = deque(maxlen=limit)
+        self.redo_stack = deque(maxlen=limit)
+        
+    def record(self, op):
+        self.undo_stack.append(op)
+        self.redo_stack.clear()
+
+
+class TrashStore:
+    """回收站 - 删除的便签追加写入 .trash.jsonl，超过保留期的在打开笔记本时清除
+    
+    内存中不保留回收站内容，只在查看、恢复时读取文件。
+    """
+    keep_days = 30
+    
+    def __init__(self, path):
+        self.path = os.path.splitext(path)[0] + ".trash.jsonl"
+        self.lock = threading.Lock()
+        
+    def add(self, notes):
+        deleted_at = time.time()
+        with self.lock, open(self.path, 'a', encoding='utf-8') as f:
+            for note in notes:
+                f.write(json.dumps({"deleted_at": deleted_at, "note": note.to_dict()}, ensure_ascii=False) + "\n")
+                
+    def read(self):
+        """返回 [(删除时间, Note)]，最近删除的在前"""
+        entries = []
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                        entries.append((record["deleted_at"], Note.from_dict(record["note"])))
+                    except (ValueError, KeyError, TypeError):
+                        continue
+        entries.reverse()
+        return entries
+        
+    def rewrite(self, entries):
+        fd, tmp_path = tempfile.mkstemp(prefix=".tmp_", suffix=".jsonl",
+                                        dir=os.path.dirname(os.path.abspath(self.path)))
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            for deleted_at, note in reversed(entries):
+                f.write(json.dumps({"deleted_at": deleted_at, "note": note.to_dict()}, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, self.path)
+        
+    def remove(self, note_ids):
+        with self.lock:
+            entries = self.read()
+            kept = [entry for entry in entries if entry[1].id not in note_ids]
+            if len(kept) != len(entries):
+                self.rewrite(kept)
+                
+    def purge(self):
+        with self.lock:
+            entries = self.read()
+            cutoff = time.time() - self.keep_days * 86400
+            kept = [entry for entry in entries if entry[0] >= cutoff]
+            if len(kept) != len(entries):
+                self.rewrite(kept)
+                
+    def clear(self):
+        with self.lock:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+
+class TemplateError(ValueError):
+    pass
+
+
+class TemplateEngine:
+    """模板便签 - 复制时展开内容中的占位符
+    
+    {date} {date:%Y年%m月%d日} {time} {counter} {counter:03d} {clipboard}
+    {@标题} 引用另一条便签的内容（可嵌套），{@标题.title}/.category/.created_at/.id 引用其他字段；
+    {{ 和 }} 表示花括号本身。不含可识别占位符的便签不是模板，原样复制。
+    
+    每条便签的内容只解析一次；展开时把引用部分拼接好的结果连同所依赖便签的修订号缓存起来，
+    依赖都没有变化时直接复用，只重新计算日期、计数等每次都不同的部分。
+    {counter} 属于写着它的便签：引用的便签中的计数取该便签自己的值，复制时也是它的计数加一。
+    """
+    pattern = re.compile(r"\{\{|\}\}|\{([^{}\n]+)\}")
+    dynamic = ("date", "time", "counter", "clipboard")
+    ref_fields = ("title", "category", "created_at", "id")
+    
+    def __init__(self, notebook):
+        self.notebook = notebook
+        self.compiled = {}       # 便签 id -> (内容, 解析结果；不是模板时为 None)
+        self.flattened = {}      # 便签 id -> (内容, 直接引用的 [(便签, 修订号, 是否展开内容)], 片段)
+        self.bindings = {}       # 引用的标题 -> 便签 id，该便签改名或删除后才重新查找
+        
+    @classmethod
+    def parse(cls, content):
+        """把内容解析为片段列表：字符串原样输出，元组为占位符；没有占位符时返回 None"""
+        parts = []
+        is_template = False
+        position = 0
+        for match in cls.pattern.finditer(content):
+            token = match.group(0)
+            inner = match.group(1)
+            if inner is None:
+                part = token[0]  # {{ 或 }}
+            elif inner.startswith("@") and len(inner) > 1:
+                name, field = inner[1:], "content"
+                head, dot, tail = name.rpartition(".")
+                if dot and head and tail in cls.ref_fields:
+                    name, field = head, tail
+                part = ("ref", name, field)
+            else:
+                name, colon, spec = inner.partition(":")
+                if name not in cls.dynamic:
+                    continue  # 不认识的花括号内容原样保留
+                part = (name, spec)
+            is_template = is_template or inner is not None
+            parts.append(content[position:match.start()])
+            parts.append(part)
+            position = match.end()
+        if not is_template:
+            return None
+        parts.append(content[position:])
+        return [part for part in parts if part != ""]
+        
+    def compile(self, note):
+        cached = self.compiled.get(note.id)
+        if cached is None or cached[0] is not note.content and cached[0] != note.content:
+            cached = (note.content, self.parse(note.content))
+            self.compiled[note.id] = cached
+        return cached[1]
+        
+    def is_template(self, note):
+        return self.compile(note) is not None
+        
+    def resolve(self, name):
+        """按标题（或 id）查找被引用的便签；标题重复时取列表中靠前的"""
+        notes_by_id = self.notebook.notes_by_id
+        note = notes_by_id.get(self.bindings.get(name))
+        if note is not None and note.title == name:
+            return note
+        note = notes_by_id.get(name)
+        if note is None:
+            note = next((note for note in self.notebook.notes if note.title == name), None)
+        if note is not None:
+            self.bindings[name] = note.id
+        return note
+        
+    def is_current(self, note, checked):
+        """缓存的展开结果是否仍然有效：内容未变，引用的便签修订号未变且它们的展开结果也有效"""
+        result = checked.get(note.id)
+        if result is None:
+            cached = self.flattened.get(note.id)
+            notes_by_id = self.notebook.notes_by_id
+            checked[note.id] = True  # 循环引用不会进入缓存，这里只是防止重复检查
+            result = (cached is not None and cached[0] == note.content
+                      and all(dep.rev == rev and notes_by_id.get(dep.id) is dep
+                              and (not nested or self.is_current(dep, checked))
+                              for dep, rev, nested in cached[1]))
+            checked[note.id] = result
+        return result
+        
+    def flatten(self, note, stack=(), checked=None):
+        """展开引用，返回片段列表：只剩字符串和每次都要重新计算的占位符
+        
+        缓存中记录直接引用的便签及其修订号，间接引用由被引用便签自己的缓存负责；
+        便签自身只比较内容，复制时计数变化不会使缓存失效。
+        """
+        if checked is None:
+            checked = {}
+        if self.is_current(note, checked):
+            return self.flattened[note.id][2]
+        stack = stack + (note,)
+        depends = []
+        segments = []
+        for part in self.compile(note) or [note.content]:
+            if type(part) is tuple and part[0] == "ref":
+                target = self.resolve(part[1])
+                if target is None:
+                    raise TemplateError(f"找不到引用的便签: {part[1]}")
+                if part[2] != "content":
+                    depends.append((target, target.rev, False))
+                    segments.append(target.to_dict()[part[2]])
+                    continue
+                if target in stack:
+                    chain = " → ".join(item.title for item in stack + (target,))
+                    raise TemplateError(f"模板循环引用: {chain}")
+                depends.append((target, target.rev, True))
+                segments.extend(self.flatten(target, stack, checked))
+            elif type(part) is tuple and part[0] == "counter":
+                segments.append(part + (note,))  # 记下计数所属的便签
+            else:
+                segments.append(part)
+        # 相邻的字符串合并，展开时少做拼接
+        merged = []
+        for segment in segments:
+            if type(segment) is str and merged and type(merged[-1]) is str:
+                merged[-1] += segment
+            else:
+                merged.append(segment)
+        self.flattened[note.id] = (note.content, depends, merged)
+        checked[note.id] = True
+        return merged
+        
+    def segments(self, note):
+        try:
+            return self.flatten(note)
+        except RecursionError:
+            raise TemplateError("模板引用嵌套过深")
+            
+    def expand(self, note, clipboard=None, counters=None):
+        """展开模板；clipboard 为取剪贴板文本的函数，只在用到 {clipboard} 时调用；
+        counters 为 {便签: 计数}，没有给出的便签计数为 0"""
+        if self.compile(note) is None:
+            return note.content
+        now = None
+        clipboard_text = None
+        result = []
+        for segment in self.segments(note):
+            if type(segment) is str:
+                result.append(segment)
+                continue
+            name, spec = segment[:2]
+            if name in ("date", "time"):
+                now = now or datetime.now()
+                result.append(now.strftime(spec or ("%Y-%m-%d" if name == "date" else "%H:%M")))
+            elif name == "counter":
+                try:
+                    result.append(format((counters or {}).get(segment[2], 0), spec))
+                except ValueError:
+                    raise TemplateError(f"计数格式无效: {spec}")
+            elif name == "clipboard":
+                if clipboard_text is None:
+                    clipboard_text = clipboard() if clipboard is not None else ""
+                result.append(clipboard_text)
+        return "".join(result)
+        
+    def render(self, note, clipboard=None):
+        """复制时调用：展开模板，用到的每个 {counter}（包括引用的便签中的）所属便签的计数加一，
+        返回 (文本, 计数变化、需要保存的便签列表)"""
+        if self.compile(note) is None:
+            return note.content, []
+        counters = {}
+        for segment in self.segments(note):
+            if type(segment) is tuple and segment[0] == "counter" and segment[2] not in counters:
+                owner = segment[2]
+                try:
+                    counters[owner] = int((owner.extra or {}).get("counter", 0)) + 1
+                except (TypeError, ValueError):
+                    counters[owner] = 1
+        text = self.expand(note, clipboard, counters)
+        for owner, counter in counters.items():
+            if owner.extra is None:
+                owner.extra = {}
+            owner.extra["counter"] = counter
+            owner.rev += 1
+        return text, list(counters)
+        
+    def forget(self, note_id):
+        self.compiled.pop(note_id, None)
+        self.flattened.pop(note_id, None)
+
+
+class Notebook:
+    """一个笔记本的全部数据：便签列表、存储、搜索索引和分类索引
+    
+    界面切换笔记本时只替换当前的 Notebook 对象；关闭存储并丢弃对象即可释放它占用的内存。
+    """
+    def __init__(self, name, path, store_class):
+        self.name = name
+        self.notes = []
+        self.notes_by_id = {}
+        self.preview_cache = {}      # 便签 id -> 预览缓存数据
+        self.order = {}              # 便签 id -> 排序值，用于给少量搜索结果排序
+        self.front_order = 0
+        self.search_index = SearchIndex()
+        self.category_ids = {}       # 分类 -> 该分类的便签 id（与 notes 同序）
+        self.index_queue = []        # 读取后分批建立索引的便签
+        self.index_position = 0
+        self.known_ids = set()       # 最近一次从文件读到的便签 id，用于区分外部删除和本地新建
+        self.loading = True
+        self.load_error = None       # 读取失败的异常；失败时保持未装入状态，不会写入数据文件
+        self.history = UndoHistory()
+        self.trash = TrashStore(path)
+        self.templates = TemplateEngine(self)
+        self.store = store_class(path, lambda: self.notes)
+        
+    def install(self, notes):
+        """读取完成：建立 id 和分类索引，搜索索引由界面分批建立"""
+        # 旧数据没有 id：补上稳定 id 并立即重写快照（日志记录依赖 id）
+        missing_id = False
+        for note in notes:
+            if not note.id:
+                note.id = uuid.uuid4().hex
+                missing_id = True
+        self.notes = notes
+        self.notes_by_id = {note.id: note for note in notes}
+        self.known_ids = set(self.notes_by_id)
+        self.category_ids = {}
+        for note in notes:
+            self.category_ids.setdefault(note.category, []).append(note.id)
+        self.order = {note.id: i for i, note in enumerate(notes)}
+        self.front_order = 0
+        self.index_queue = list(notes)
+        self.index_position = 0
+        self.loading = False
+        if missing_id or self.store.needs_compact:
+            self.store.compact()
+            
+    def merge_plan(self, disk_notes):
+        """按便签 id 和修订号对比文件中的数据，返回 (新增, [(本地, 外部)], 删除的 id, 文件中的 id)"""
+        # 本实例新建并已写入的便签也算读到过：文件里没有了说明被其他实例删除
+        known_ids = self.known_ids | self.store.read_written_ids
+        disk_ids = set()
+        added = []
+        updated = []
+        for note in disk_notes:
+            note_id = note.id
+            if not note_id:
+                continue
+            disk_ids.add(note_id)
+            local = self.notes_by_id.get(note_id)
+            if local is None:
+                if note_id not in known_ids:  # 否则是本地已删除、尚未写入
+                    added.append(note)
+            elif note.rev > local.rev:
+                updated.append((local, note))
+        # 上次读到、这次文件里没有的：其他实例删除了
+        removed = [note_id for note_id in known_ids - disk_ids if note_id in self.notes_by_id]
+        return added, updated, removed, disk_ids
+        
+    def apply_merge(self, plan):
+        """只合并便签列表，不维护索引（笔记本关闭前写入用）"""
+        added, updated, removed, disk_ids = plan
+        for note_id in removed:
+            self.notes.remove(self.notes_by_id.pop(note_id))
+        for local, note in updated:
+            pinned = local.pinned
+            local.update_from(note)
+            if local.pinned != pinned:
+                # 其他实例置顶或取消置顶：移到置顶便签的开头或末尾
+                self.notes.remove(local)
+                self.notes.insert(0 if local.pinned else self.pinned_count(), local)
+        start = self.pinned_count()
+        self.notes[start:start] = [note for note in added if not note.pinned]
+        self.notes[:0] = [note for note in added if note.pinned]
+        self.notes_by_id.update((note.id, note) for note in added)
+        self.known_ids = disk_ids
+        
+    def load(self):
+        """同步读取（命令行等一次性使用；界面在后台读取、分批建索引）
+        
+        不建立搜索索引：一次查询逐条比对比先建索引快得多，search() 会比对未索引的便签。
+        """
+        notes, signature = self.store.read()
+        self.install(notes)
+        self.store.seen = signature
+        
+    def index_some(self, deadline=None):
+        """为读取或导入的便签建立搜索索引，到 deadline（perf_counter 时间）为止；全部完成时返回 True"""
+        index_queue = self.index_queue
+        queue_length = len(index_queue)
+        position = self.index_position
+        while position < queue_length and (deadline is None or time.perf_counter() < deadline):
+            end = min(position + 200, queue_length)
+            for note in index_queue[position:end]:
+                if note.id in self.notes_by_id:  # 期间可能已被删除
+                    self.search_index.add(note)
+            position = end
+        self.index_position = position
+        if position < queue_length:
+            return False
+        self.index_queue = []
+        self.index_position = 0
+        return True
+        
+    def insert(self, note, index=0):
+        """把便签插入到 index 处并更新各索引，返回实际位置"""
+        notes = self.notes
+        index = min(index, len(notes))
+        notes.insert(index, note)
+        self.notes_by_id[note.id] = note
+        self.assign_rank(index)
+        self.insert_category_id(note.category, note.id)
+        self.search_index.add(note)
+        return index
+        
+    def assign_rank(self, index):
+        """给第 index 条便签取前后两条排序值的中点，只改这一条；间隔用尽时整体重新编号"""
+        notes = self.notes
+        order = self.order
+        note_id = notes[index].id
+        if index == 0:
+            self.front_order -= 1
+            order[note_id] = self.front_order
+        elif index == len(notes) - 1:
+            order[note_id] = order[notes[index - 1].id] + 1
+        else:
+            low, high = order[notes[index - 1].id], order[notes[index + 1].id]
+            rank = (low + high) / 2
+            if low < rank < high:
+                order[note_id] = rank
+            else:
+                self.renumber()
+                
+    def renumber(self):
+        """按列表顺序重新编号（排序值保持相对顺序，分类列表不必调整）"""
+        self.order = {note.id: i for i, note in enumerate(self.notes)}
+        self.front_order = 0
+        
+    def pinned_count(self):
+        """置顶的便签都在列表开头，新便签插入到它们之后"""
+        count = 0
+        for note in self.notes:
+            if not note.pinned:
+                break
+            count += 1
+        return count
+        
+    def neighbours(self, index):
+        """第 index 条前后两条便签的 id，存储按它们定位移动后的位置"""
+        notes = self.notes
+        after = notes[index - 1].id if index > 0 else None
+        before = notes[index + 1].id if index + 1 < len(notes) else None
+        return after, before
+        
+    def move(self, note, index):
+        """把便签移到 index 处：列表中移动一次，只改这一条的排序值和它在分类列表中的位置，返回原位置"""
+        notes = self.notes
+        old_index = notes.index(note)
+        index = max(0, min(index, len(notes) - 1))
+        if index == old_index:
+            return old_index
+        del notes[old_index]
+        notes.insert(index, note)
+        self.category_ids[note.category].remove(note.id)
+        self.assign_rank(index)
+        self.insert_category_id(note.category, note.id)
+        return old_index
+        
+    def prepend(self, notes):
+        """批量插入到列表开头（导入用）：补全 id 和创建时间，各索引一次更新
+        
+        带置顶标记的插到最前，其余插到置顶便签之后，与单条置顶的位置一致。
+        搜索索引排入分批建立的队列；队列原本为空、需要开始建立时返回 True。
+        """
+        now = Note.now()
+        for note in notes:
+            if not note.id or note.id in self.notes_by_id:
+                note.id = uuid.uuid4().hex
+            if not note.created:
+                note.created = now
+            note.rev = max(note.rev, 1)
+        
+        pinned = [note for note in notes if note.pinned]
+        others = [note for note in notes if not note.pinned]
+        start = self.pinned_count()
+        if pinned:
+            self.insert_block(0, pinned)
+        if others:
+            self.insert_block(start + len(pinned), others)
+        
+        if self.index_queue:
+            self.index_queue.extend(notes)
+            return False
+        self.index_queue = list(notes)
+        self.index_position = 0
+        return True
+        
+    def insert_block(self, start, notes):
+        """把一批便签连续插入到 start 处，排序值在前后两条之间均分"""
+        end = start + len(notes)
+        self.notes[start:start] = notes
+        self.notes_by_id.update((note.id, note) for note in notes)
+        order = self.order
+        if start == 0:
+            first = self.front_order - len(notes)
+            order.update((note.id, first + i) for i, note in enumerate(notes))
+            self.front_order = first
+        else:
+            low = order[self.notes[start - 1].id]
+            high = order[self.notes[end].id] if end < len(self.notes) else low + len(notes) + 1
+            step = (high - low) / (len(notes) + 1)
+            order.update((note.id, low + step * (i + 1)) for i, note in enumerate(notes))
+            first, last = order[notes[0].id], order[notes[-1].id]
+            if not (low < first < first + step and last < high):
+                self.renumber()  # 间隔不够分
+        by_category = {}
+        for note in notes:
+            by_category.setdefault(note.category, []).append(note.id)
+        for category, ids in by_category.items():
+            existing = self.category_ids.setdefault(category, [])
+            position = self.category_position(existing, order[ids[0]])
+            existing[position:position] = ids
+        
+    def remove(self, note_id):
+        """从列表和各索引中移除一条便签，返回该便签（不存在时返回 None）"""
+        note = self.notes_by_id.pop(note_id, None)
+        if note is not None:
+            self.notes.remove(note)
+            self.search_index.remove(note)
+            self.category_ids[note.category].remove(note_id)
+            self.order.pop(note_id, None)
+            self.preview_cache.pop(note_id, None)
+            self.templates.forget(note_id)
+        return note
+        
+    def remove_many(self, note_ids):
+        """移除多条便签并返回 [(原位置, 便签)]，列表和分类索引各重建一次"""
+        removing = set(note_ids)
+        entries = [(i, note) for i, note in enumerate(self.notes) if note.id in removing]
+        self.notes[:] = [note for note in self.notes if note.id not in removing]
+        for index, note in entries:
+            del self.notes_by_id[note.id]
+            self.search_index.remove(note)
+            self.order.pop(note.id, None)
+            self.preview_cache.pop(note.id, None)
+            self.templates.forget(note.id)
+        for category in {note.category for index, note in entries}:
+            self.category_ids[category] = [i for i in self.category_ids[category] if i not in removing]
+        return entries
+        
+    def restore_many(self, entries):
+        """把 remove_many 移除的便签放回原来的位置，entries 为按位置升序的 [(位置, 便签)]"""
+        notes = self.notes
+        merged = []
+        position = 0
+        for index, note in entries:
+            take = max(0, index - len(merged))
+            merged.extend(notes[position:position + take])
+            position += take
+            merged.append(note)
+        merged.extend(notes[position:])
+        notes[:] = merged
+        self.notes_by_id.update((note.id, note) for index, note in entries)
+        self.order = {note.id: i for i, note in enumerate(notes)}
+        self.front_order = 0
+        self.category_ids = {}
+        for note in notes:
+            self.category_ids.setdefault(note.category, []).append(note.id)
+        for index, note in entries:
+            self.search_index.add(note)
+            
+    def update(self, note, values):
+        """修改便签字段并更新索引（不写入存储），返回修改前的值"""
+        old = {field: getattr(note, field) for field in values}
+        for field, value in values.items():
+            setattr(note, field, value)
+        note.rev += 1
+        self.search_index.update(note, old)
+        if "category" in old:
+            self.move_category(note, old["category"])
+        return old
+        
+    def move_category(self, note, old_category):
+        """便签的分类变了：移到新分类的 id 列表中，返回是否有变化"""
+        if old_category == note.category:
+            return False
+        self.category_ids[old_category].remove(note.id)
+        self.insert_category_id(note.category, note.id)
+        return True
+        
+    def insert_category_id(self, category, note_id):
+        ids = self.category_ids.setdefault(category, [])
+        ids.insert(self.category_position(ids, self.order[note_id]), note_id)
+        
+    def category_position(self, ids, key):
+        """按排序值二分查找 key 在分类列表中的插入位置"""
+        order = self.order
+        low, high = 0, len(ids)
+        while low < high:
+            middle = (low + high) // 2
+            if order[ids[middle]] < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+        
+    def category_counts(self):
+        return {category: len(ids) for category, ids in self.category_ids.items() if ids}
+        
+    def search(self, query, category=None):
+        """按搜索词和分类过滤，结果保持列表顺序；都为空时返回 notes 本身"""
+        hits = self.search_index.search(query, category)
+        if hits is not None and self.index_position < len(self.index_queue):
+            # 索引尚未建完：未索引的部分逐条比对
+            matches = SearchIndex.matcher(query.lower().split())
+            notes_by_id = self.notes_by_id
+            for note in self.index_queue[self.index_position:]:
+                if (category is None or note.category == category) and note.id in notes_by_id and matches(note):
+                    hits.add(note)
+        if hits is None and category is None:
+            return self.notes
+        base_ids = None if category is None else self.category_ids.get(category, [])
+        if hits is not None and len(hits) * 8 < len(self.notes if base_ids is None else base_ids):
+            # 结果较少时按排序值排序，不扫描全部便签
+            order = self.order
+            return sorted(hits, key=lambda note: order[note.id])
+        base = self.notes if base_ids is None else map(self.notes_by_id.__getitem__, base_ids)
+        if hits is None:
+            return list(base)
+        return [note for note in base if note in hits]
+        
+    def find(self, key):
+        """按 id、id 前缀或完整标题查找便签（命令行用），找不到或不唯一时返回 None"""
+        note = self.notes_by_id.get(key)
+        if note is not None:
+            return note
+        matches = [note for note in self.notes if note.id.startswith(key)] if key else []
+        if not matches:
+            matches = [note for note in self.notes if note.title == key]
+        return matches[0] if len(matches) == 1 else None
+
+
+class NotebookManifest:
+    """笔记本清单 - 只记录名称、数据文件和便签数量，列出笔记本时不必读取各自的数据"""
+    default_name = "默认"
+    
+    def __init__(self, path, default_file):
+        self.path = path
+        self.notebooks = [{"name": self.default_name, "file": default_file, "count": None}]
+        self.active = self.default_name
+        try:
+            if os.path.exists(path):
+                with open(path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                self.notebooks = data["notebooks"] or self.notebooks
+                self.active = data.get("active", self.active)
+        except (OSError, ValueError, KeyError):
+            pass
+        if self.get(self.active) is None:
+            self.active = self.notebooks[0]["name"]
+            
+    def get(self, name):
+        for entry in self.notebooks:
+            if entry["name"] == name:
+                return entry
+        return None
+        
+    def add(self, name):
+        entry = {"name": name, "file": f"sticky_notes_{uuid.uuid4().hex[:8]}.json", "count": 0}
+        self.notebooks.append(entry)
+        return entry
+        
+    def save(self):
+        atomic_write_json(self.path, {"active": self.active, "notebooks": self.notebooks})
+
+
+# 导入时识别的列名（不区分大小写）；CSV 没有可识别的表头时按 标题, 内容, 分类 的列顺序读取
+IMPORT_COLUMNS = {
+    "title": ("title", "标题", "名称"),
+    "content": ("content", "内容", "正文"),
+    "category": ("category", "分类", "类别"),
+    "created_at": ("created_at", "创建时间"),
+}
+EXPORT_COLUMNS = ("title", "content", "category", "created_at")
+
+
+def detect_encoding(path):
+    """Excel 在中文系统上另存的 CSV 通常是 GBK，其余按 UTF-8（可带 BOM）读取"""
+    with open(path, 'rb') as f:
+        head = f.read(65536)
+    try:
+        codecs.getincrementaldecoder("utf-8")().decode(head)  # 末尾截断的多字节字符不算错误
+        return "utf-8-sig"
+    except UnicodeDecodeError:
+        return "gbk"
+
+
+def iter_import_file(path):
+    """逐行读取 CSV 或 JSON Lines 文件，生成 (已读字节数, Note)，不把整个文件读入内存
+    
+    也接受本工具的 .json 数据文件（整体读取）。
+    """
+    extension = os.path.splitext(path)[1].lower()
+    with open(path, 'r', encoding=detect_encoding(path), newline="") as f:
+        if extension == ".json":
+            for data in json.load(f):
+                yield f.buffer.tell(), Note.from_dict(data)
+            return
+        if extension in (".jsonl", ".ndjson"):
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    data = json.loads(line)
+                except ValueError:
+                    raise ValueError(f"第 {line_number} 行不是有效的 JSON")
+                yield f.buffer.tell(), Note.from_dict(data)
+            return
+        
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header is None:
+            return
+        names = [name.strip().lower() for name in header]
+        mapping = {}
+        for field, aliases in IMPORT_COLUMNS.items():
+            for i, name in enumerate(names):
+                if name in aliases:
+                    mapping[field] = i
+                    break
+        rows = reader
+        if not mapping:
+            mapping = {"title": 0, "content": 1, "category": 2}
+            rows = itertools.chain([header], reader)  # 第一行就是数据
+        for row in rows:
+            if not any(cell.strip() for cell in row):
+                continue
+            data = {field: row[i].strip() for field, i in mapping.items() if i < len(row)}
+            yield f.buffer.tell(), Note.from_dict(data)
+
+
+def write_export_file(path, notes):
+    """逐条写出 CSV（带 BOM，Excel 可直接打开）或 JSON Lines，返回写出的条数"""
+    count = 0
+    if os.path.splitext(path)[1].lower() == ".csv":
+        with open(path, 'w', encoding='utf-8-sig', newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(EXPORT_COLUMNS)
+            for note in notes:
+                data = note.to_dict()
+                writer.writerow([data.get(column, "") for column in EXPORT_COLUMNS])
+                count += 1
+    else:
+        with open(path, 'w', encoding='utf-8') as f:
+            for note in notes:
+                f.write(json.dumps(note.to_dict(), ensure_ascii=False) + "\n")
+                count += 1
+    return count
+
+
+def load_config(path=CONFIG_FILE):
+    """读取配置文件（窗口位置、透明度、存储方式等），读取失败时返回空配置"""
+    try:
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+    except (OSError, ValueError):
+        pass
+    return {}
+
+
+def open_notebook(name=None, config=None, manifest_path=MANIFEST_FILE):
+    """按清单打开笔记本（默认为上次使用的），返回尚未读取的 Notebook；名称不存在时返回 None"""
+    if config is None:
+        config = load_config()
+    manifest = NotebookManifest(manifest_path, DATA_FILE)
+    entry = manifest.get(name or manifest.active)
+    if entry is None:
+        return None
+    store_class = STORAGE_BACKENDS.get(config.get("storage"), JournalStore)
+    return Notebook(entry["name"], entry["file"], store_class)
+
+
+class CommandHandler(socketserver.StreamRequestHandler):
+    """一个连接：逐行读取 JSON 请求并逐行写回响应，同一连接可以连续发送多条"""
+    max_line = 1 << 20
+    
+    def handle(self):
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        server = self.server.command_server
+        while True:
+            line = self.rfile.readline(self.max_line)
+            if not line:
+                return
+            try:
+                request = json.loads(line.decode("utf-8"))
+                if not isinstance(request, dict):
+                    raise ValueError
+            except ValueError:
+                response = {"ok": False, "error": "请求不是有效的 JSON"}
+            else:
+                # 按字节比较：compare_digest 不接受含非 ASCII 字符的 str
+                token = str(request.get("token", "")).encode("utf-8", "surrogatepass")
+                if not hmac.compare_digest(token, server.token.encode("utf-8")):
+                    self.reply({"ok": False, "error": "口令错误"})
+                    return
+                try:
+                    response = server.handle(request)
+                except Exception as e:
+                    response = {"ok": False, "error": str(e)}
+            self.reply(response)
+            
+    def reply(self, response):
+        self.wfile.write((json.dumps(response, ensure_ascii=False) + "\n").encode("utf-8"))
+        self.wfile.flush()
+
+
+class CommandServer:
+    """本机命令服务 - 监听 127.0.0.1 的随机端口，让脚本和再次启动的程序驱动正在运行的实例
+    
+    端口号和随机口令写入 PORT_FILE（仅当前用户可读），请求必须带上口令。
+    每个连接一个线程，handle(request) 在该线程中调用并返回响应字典。
+    """
+    def __init__(self, handle, path=PORT_FILE):
+        self.handle = handle
+        self.path = path
+        self.token = uuid.uuid4().hex
+        self.server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), CommandHandler)
+        self.server.daemon_threads = True
+        self.server.command_server = self
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, name="CommandServer", daemon=True)
+        self.thread.start()
+        atomic_write_json(path, {"port": self.port, "token": self.token, "pid": os.getpid()}, private=True)
+        
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+        try:
+            # 端口文件可能已被后来启动的实例替换，只删除自己的
+            with open(self.path, 'r', encoding='utf-8') as f:
+                if json.load(f).get("token") == self.token:
+                    os.remove(self.path)
+        except (OSError, ValueError):
+            pass
+
+
+def send_command(command, path=PORT_FILE, timeout=2.0, **args):
+    """向正在运行的实例发送一条命令并返回响应字典；没有运行中的实例时抛出 OSError"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            info = json.load(f)
+        port, token = info["port"], info["token"]
+    except (ValueError, KeyError, TypeError):
+        raise OSError("端口文件已损坏")
+    request = dict(args, cmd=command, token=token)
+    with socket.create_connection(("127.0.0.1", port), timeout=timeout) as sock:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.sendall((json.dumps(request, ensure_ascii=False) + "\n").encode("utf-8"))
+        with sock.makefile("rb") as f:
+            line = f.readline()
+    if not line:
+        raise OSError("连接已关闭")
+    try:
+        return json.loads(line.decode("utf-8"))
+    except ValueError:
+        raise OSError("响应不是有效的 JSON")
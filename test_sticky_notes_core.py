@@ -0,0 +1,374 @@
+"""
+核心库的无界面测试：python -m pytest test_sticky_notes_core.py
+"""
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+import uuid
+
+from sticky_notes_cli import save
+from sticky_notes_core import (UMASK, CommandServer, FileLock, JournalStore, JsonStore, Note, Notebook, SqliteStore,
+                               atomic_write_json, send_command)
+
+
+def make_note(title):
+    return Note(id=uuid.uuid4().hex, title=title, content=title, category="常用", created=Note.now(), rev=1)
+
+
+class StoreRoundTripTest(unittest.TestCase):
+    """同一个保存间隔内的多次修改写入后重新读取，顺序和内容与内存中一致"""
+    store_class = JournalStore
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "notes.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def open(self):
+        notebook = Notebook("test", self.path, self.store_class)
+        notebook.load()
+        return notebook
+
+    def reopen(self, notebook):
+        notebook.store.close()
+        reloaded = self.open()
+        self.addCleanup(reloaded.store.close)
+        self.assertEqual([note.id for note in reloaded.notes], [note.id for note in notebook.notes])
+        self.assertEqual([note.content for note in reloaded.notes], [note.content for note in notebook.notes])
+        return reloaded
+
+    def insert(self, notebook, note, index):
+        index = notebook.insert(note, index)
+        notebook.store.put(note, index=index)
+
+    def seed(self, count):
+        notebook = self.open()
+        for i in range(count):
+            self.insert(notebook, make_note(str(i)), i)
+        return self.reopen(notebook)
+
+    def test_delete_after_positional_inserts(self):
+        notebook = self.seed(3)
+        x, y = make_note("x"), make_note("y")
+        self.insert(notebook, x, 0)
+        self.insert(notebook, y, 2)
+        notebook.remove(x.id)
+        notebook.store.delete(x.id)
+        self.assertEqual([note.title for note in notebook.notes], ["0", "y", "1", "2"])
+        self.reopen(notebook)
+
+    def test_random_batches(self):
+        rng = random.Random(4)
+        notebook = self.seed(20)
+        for batch in range(30):
+            added = []
+            for step in range(rng.randint(1, 12)):
+                notes = notebook.notes
+                action = rng.random()
+                if action < 0.35 or len(notes) < 3:
+                    note = make_note(f"n{batch}-{step}")
+                    self.insert(notebook, note, rng.randint(0, len(notes)))
+                    added.append(note.id)
+                elif action < 0.55:
+                    # 多半删除本批刚新建的便签
+                    live = [note_id for note_id in added if note_id in notebook.notes_by_id]
+                    note_id = rng.choice(live) if live and rng.random() < 0.7 else rng.choice(notes).id
+                    notebook.remove(note_id)
+                    notebook.store.delete(note_id)
+                elif action < 0.7:
+                    # 撤销删除：按原位置放回
+                    entries = notebook.remove_many([note.id for note in rng.sample(notes, 2)])
+                    for index, note in entries:
+                        notebook.store.delete(note.id)
+                    notebook.restore_many(entries)
+                    for index, note in entries:
+                        notebook.store.put(note, index=index)
+                elif action < 0.85:
+                    note = rng.choice(notes)
+                    notebook.move(note, rng.randint(0, len(notes) - 1))
+                    index = notes.index(note)
+                    notebook.store.move(note.id, *notebook.neighbours(index))
+                else:
+                    note = rng.choice(notes)
+                    notebook.update(note, {"content": f"{note.content}+"})
+                    notebook.store.put(note)
+            notebook = self.reopen(notebook)
+
+    def test_external_delete_of_local_note(self):
+        # 本实例新建并已写入的便签被其他实例删除：合并后删除，整体重写也不会恢复
+        notebook = self.seed(1)
+        note = make_note("local")
+        self.insert(notebook, note, 0)
+        notebook.store.flush()
+        other = self.open()
+        other.remove(note.id)
+        other.store.delete(note.id)
+        other.store.close()
+        notes, signature = notebook.store.read()
+        notebook.apply_merge(notebook.merge_plan(notes))
+        notebook.store.seen = signature
+        self.assertNotIn(note.id, notebook.notes_by_id)
+        notebook.store.compact()
+        self.assertEqual([note.title for note in self.reopen(notebook).notes], ["0"])
+
+    def test_cli_rewrite_merges_external_insert(self):
+        # 命令行导入需要整体重写，其间另一个实例新建的便签不能丢失
+        notebook = self.seed(1)
+        other = self.open()
+        self.addCleanup(other.store.close)
+        self.insert(other, make_note("other"), 0)
+        other.store.flush()
+        notebook.prepend([make_note("imported")])
+        notebook.store.compact()
+        save(notebook)
+        notebook.store.close()
+        reloaded = self.open()
+        self.addCleanup(reloaded.store.close)
+        self.assertEqual(sorted(note.title for note in reloaded.notes), ["0", "imported", "other"])
+
+
+class JsonStoreRoundTripTest(StoreRoundTripTest):
+    store_class = JsonStore
+
+
+class SqliteStoreRoundTripTest(StoreRoundTripTest):
+    store_class = SqliteStore
+
+    def test_search_matches_notebook(self):
+        notebook = self.seed(0)
+        for i, content in enumerate(["北京市海淀区", "纳税人识别号 9112", "Road_5 海淀", "100%"]):
+            self.insert(notebook, make_note(content), i)
+        notebook = self.reopen(notebook)
+        store = notebook.store
+        for query in ["海淀", "海", "9112", "road_5 海淀", "100%", "_", "识别号"]:
+            expected = [note.id for note in notebook.search(query)]
+            self.assertEqual([note.id for note in store.search(query)], expected, query)
+
+    def test_emptied_database_is_not_migrated_again(self):
+        legacy = Notebook("test", self.path, JsonStore)
+        legacy.install([])
+        legacy.insert(make_note("legacy"), 0)
+        legacy.store.compact()
+        legacy.store.close()
+        notebook = self.open()
+        self.assertEqual([note.title for note in notebook.notes], ["legacy"])
+        notebook.store.compact()  # 界面和命令行在导入后整体写入
+        notebook = self.reopen(notebook)
+        note_id = notebook.notes[0].id
+        notebook.remove(note_id)
+        notebook.store.delete(note_id)
+        notebook = self.reopen(notebook)
+        self.assertEqual(notebook.notes, [])
+        self.assertTrue(notebook.store.direct_query)
+
+    def test_watch_does_not_wait_for_writer(self):
+        notebook = self.seed(1)
+        store = notebook.store
+        with store.conn_lock:  # 后台线程正在整理
+            self.assertFalse(store.external_changed(wait=False))
+        self.assertFalse(store.external_changed())
+
+
+class SearchTest(unittest.TestCase):
+    """倒排索引的结果与逐条比对一致，修改、删除后也一致"""
+    words = ["北京", "海淀区", "纳税人识别号", "9112", "0108", "Road", "A", "号", "1"]
+    categories = ["常用", "地址", "电话"]
+
+    def expected(self, notebook, query, category):
+        terms = query.lower().split()
+        return [note for note in notebook.notes
+                if (category is None or note.category == category)
+                and all(term in f"{note.title}\n{note.content}".lower() for term in terms)]
+
+    def random_text(self, rng):
+        return "".join(rng.choice(self.words) for i in range(rng.randint(0, 4)))
+
+    def test_matches_linear_scan(self):
+        rng = random.Random(6)
+        notebook = Notebook("test", os.path.join(tempfile.mkdtemp(), "notes.json"), JsonStore)
+        self.addCleanup(shutil.rmtree, os.path.dirname(notebook.store.path))
+        self.addCleanup(notebook.store.close)
+        queries = ["1", "a", "号", "海淀", "road", "识别号9", "北京 0108", "9112 road", "12", "不存在"]
+        notes = []
+        for i in range(40):
+            note = make_note(self.random_text(rng))
+            note.content = self.random_text(rng)
+            note.category = rng.choice(self.categories)
+            notes.append(note)
+        notebook.install(notes)
+        notebook.index_some(time.perf_counter())  # 尚未建立索引：逐条比对
+        for query in queries:
+            self.assertEqual(notebook.search(query, "地址"), self.expected(notebook, query, "地址"), query)
+        notebook.index_some()
+        for step in range(400):
+            action = rng.random()
+            if action < 0.5 or len(notebook.notes) < 5:
+                note = make_note(self.random_text(rng))
+                note.content = self.random_text(rng)
+                note.category = rng.choice(self.categories)
+                notebook.insert(note, rng.randint(0, len(notebook.notes)))
+            elif action < 0.8:
+                values = {"content": self.random_text(rng)}
+                if rng.random() < 0.5:
+                    values["category"] = rng.choice(self.categories)
+                notebook.update(rng.choice(notebook.notes), values)
+            else:
+                notebook.remove(rng.choice(notebook.notes).id)
+            if step % 20 == 0:
+                for query in queries:
+                    for category in [None] + self.categories:
+                        self.assertEqual(notebook.search(query, category),
+                                         self.expected(notebook, query, category), (query, category))
+
+
+class PinnedTest(unittest.TestCase):
+    """置顶的便签始终在列表开头：导入和合并其他实例的修改也不例外"""
+    def setUp(self):
+        self.notebook = Notebook("test", os.path.join(tempfile.mkdtemp(), "notes.json"), JsonStore)
+        self.addCleanup(shutil.rmtree, os.path.dirname(self.notebook.store.path))
+        self.addCleanup(self.notebook.store.close)
+        notes = [make_note(title) for title in ["p", "a", "b"]]
+        notes[0].pinned = True
+        self.notebook.install(notes)
+
+    def titles(self):
+        return [note.title for note in self.notebook.notes]
+
+    def test_prepend_puts_pinned_notes_first(self):
+        pinned, plain = make_note("q"), make_note("c")
+        pinned.pinned = True
+        self.notebook.prepend([plain, pinned])
+        self.assertEqual(self.titles(), ["q", "p", "c", "a", "b"])
+        self.assertEqual(self.notebook.search(""), self.notebook.notes)
+        self.assertEqual(sorted(self.notebook.notes, key=lambda note: self.notebook.order[note.id]),
+                         self.notebook.notes)
+
+    def test_merge_moves_notes_pinned_elsewhere(self):
+        notebook = self.notebook
+        changed = []
+        for note in notebook.notes[:2]:
+            copy = Note.from_dict(note.to_dict())
+            copy.pinned = not copy.pinned
+            copy.rev += 1
+            changed.append(copy)
+        notebook.apply_merge(notebook.merge_plan(changed + [notebook.notes[2]]))
+        self.assertEqual(self.titles(), ["a", "p", "b"])
+        self.assertEqual(notebook.pinned_count(), 1)
+
+
+class TemplateTest(unittest.TestCase):
+    def setUp(self):
+        self.notebook = Notebook("test", os.path.join(tempfile.mkdtemp(), "notes.json"), JsonStore)
+        self.addCleanup(shutil.rmtree, os.path.dirname(self.notebook.store.path))
+        self.addCleanup(self.notebook.store.close)
+        self.notebook.install([])
+
+    def add(self, title, content):
+        note = make_note(title)
+        note.content = content
+        self.notebook.insert(note, len(self.notebook.notes))
+        return note
+
+    def test_nested_counter_belongs_to_referenced_note(self):
+        addr = self.add("addr", "Ref-{counter:03d}")
+        outer = self.add("outer", "See {@addr} #{counter}")
+        render = self.notebook.templates.render
+        self.assertEqual(render(outer), ("See Ref-001 #1", [addr, outer]))
+        self.assertEqual(render(outer)[0], "See Ref-002 #2")
+        self.assertEqual(render(addr), ("Ref-003", [addr]))
+        self.assertEqual(render(outer)[0], "See Ref-004 #3")
+        self.assertEqual((addr.extra["counter"], outer.extra["counter"]), (4, 3))
+
+    def test_plain_reference_changes_nothing(self):
+        self.add("addr", "北京市海淀区")
+        outer = self.add("outer", "地址：{@addr}")
+        rev = outer.rev
+        self.assertEqual(self.notebook.templates.render(outer), ("地址：北京市海淀区", []))
+        self.assertEqual(outer.rev, rev)
+
+
+@unittest.skipIf(os.name == "nt", "Windows 只有只读属性")
+class AtomicWriteTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "notes.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def mode(self):
+        return os.stat(self.path).st_mode & 0o777
+
+    def test_keeps_mode_of_existing_file(self):
+        atomic_write_json(self.path, [])
+        self.assertEqual(self.mode(), 0o666 & ~UMASK)
+        os.chmod(self.path, 0o640)
+        atomic_write_json(self.path, [1])
+        self.assertEqual(self.mode(), 0o640)
+
+    def test_private_file_is_owner_only(self):
+        atomic_write_json(self.path, {}, private=True)
+        self.assertEqual(self.mode(), 0o600)
+
+
+class CommandServerTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.server = CommandServer(lambda request: {"ok": True}, os.path.join(self.dir, "server.port"))
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.addCleanup(self.server.close)
+
+    def send(self, token):
+        path = os.path.join(self.dir, "client.port")
+        atomic_write_json(path, {"port": self.server.port, "token": token})
+        return send_command("focus", path)
+
+    def test_token(self):
+        self.assertEqual(self.send(self.server.token), {"ok": True})
+        for token in ["wrong", "口令"]:
+            self.assertEqual(self.send(token), {"ok": False, "error": "口令错误"}, token)
+
+
+class FileLockTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.lock = FileLock(os.path.join(self.dir, "notes.json"), timeout=1.0)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write_lock(self, owner):
+        with open(self.lock.path, 'w', encoding='utf-8') as f:
+            f.write(owner)
+
+    def test_lock_of_exited_process_is_cleared(self):
+        # 崩溃的实例留下的锁文件：本机进程已退出，不必等到超时
+        process = subprocess.Popen([sys.executable, "-c", "pass"])
+        process.wait()
+        self.write_lock(f"{socket.gethostname()} {process.pid}")
+        started = time.monotonic()
+        with self.lock:
+            pass
+        self.assertLess(time.monotonic() - started, 0.5)
+        self.assertFalse(os.path.exists(self.lock.path))
+
+    def test_lock_of_running_process_is_kept(self):
+        self.write_lock(f"{socket.gethostname()} {os.getpid()}")
+        with self.assertRaises(TimeoutError):
+            with self.lock:
+                pass
+
+    def test_default_timeout_outlasts_stale_window(self):
+        self.assertGreater(FileLock("x").timeout, FileLock.stale_after)
+
+
+if __name__ == "__main__":
+    unittest.main()